@@ -12,7 +12,7 @@ bl_info = {
 }
 
 import bpy
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, FloatProperty
 from bpy.types import Operator, AddonPreferences
 from bpy.utils import register_class, unregister_class
 
@@ -80,6 +80,11 @@ def try_register_mitsuba(context):
     if could_init_mitsuba:
         io.register()
         engine.register()
+        engine.worker.set_kernel_cache_dir(bpy.path.abspath(prefs.drjit_cache_dir) if prefs.drjit_cache_dir else None)
+        if prefs.use_warm_up:
+            import mitsuba
+            if prefs.warm_up_variant in mitsuba.variants():
+                engine.worker.start_warm_up(prefs.warm_up_variant)
 
     return could_init_mitsuba
 
@@ -184,6 +189,11 @@ def update_mitsuba_custom_path(self, context):
         if not self.is_mitsuba_initialized:
             try_reload_mitsuba(context)
 
+def update_drjit_cache_dir(self, context):
+    engine.worker.set_kernel_cache_dir(bpy.path.abspath(self.drjit_cache_dir) if self.drjit_cache_dir else None)
+    # Running workers keep the previous cache
+    engine.worker.shutdown_worker()
+
 def update_installed_dependencies_version(self, context):
     self.has_valid_dependencies_version = self.installed_dependencies_version == DEPS_MITSUBA_VERSION
 
@@ -257,6 +267,44 @@ class MitsubaPreferences(AddonPreferences):
         subtype = 'DIR_PATH',
     )
 
+    # JIT variants
+
+    drjit_cache_dir : StringProperty(
+        name = 'Kernel cache directory',
+        description = "Directory where Dr.Jit saves the compiled kernels of the LLVM and CUDA variants in the render worker and warm-up processes. Blender's own process always uses the default one. Leave empty for the default one",
+        default = '',
+        subtype = 'DIR_PATH',
+        update = update_drjit_cache_dir,
+    )
+
+    use_warm_up : BoolProperty(
+        name = 'Warm up on load',
+        description = 'Render a tiny scene in a background process when the add-on is loaded, so that the kernels of the warm-up variant are compiled before the first render',
+        default = False,
+    )
+
+    warm_up_variant : StringProperty(
+        name = 'Warm-up variant',
+        description = 'Mitsuba variant to warm up, e.g. llvm_ad_rgb',
+        default = 'llvm_ad_rgb',
+    )
+
+    # Export
+
+    mesh_cache_dir : StringProperty(
+        name = 'Mesh cache directory',
+        description = 'Directory where the exporter keeps the PLY files of previous exports, so that unchanged meshes are linked rather than written again. Leave empty for a directory in the temporary folder',
+        default = '',
+        subtype = 'DIR_PATH',
+    )
+
+    mesh_cache_size : FloatProperty(
+        name = 'Mesh cache size (GB)',
+        description = 'Maximum size of the mesh cache. The least recently used meshes are removed first',
+        default = 20.0,
+        min = 0.0,
+    )
+
     def draw(self, context):
         layout = self.layout
 
@@ -280,6 +328,14 @@ class MitsubaPreferences(AddonPreferences):
         box.prop(self, 'using_mitsuba_custom_path', text=f'Use custom Mitsuba path (Supported version is v{DEPS_MITSUBA_VERSION})')
         if self.using_mitsuba_custom_path:
             box.prop(self, 'mitsuba_custom_path')
+        box.prop(self, 'drjit_cache_dir')
+        row = box.row()
+        row.prop(self, 'use_warm_up')
+        sub = row.row()
+        sub.active = self.use_warm_up
+        sub.prop(self, 'warm_up_variant', text='')
+        box.prop(self, 'mesh_cache_dir')
+        box.prop(self, 'mesh_cache_size')
 
 classes = (
     MITSUBA_OT_install_pip_dependencies,
@@ -19,15 +19,21 @@ def get_panels():
     return panels
 
 def register():
-    from . import properties
+    from . import properties, batch, output
     properties.register()
+    batch.register()
+    output.register()
     bpy.utils.register_class(MitsubaRenderEngine)
     for panel in get_panels():
         panel.COMPAT_ENGINES.add('MITSUBA')
 
 def unregister():
-    from . import properties
+    from . import properties, batch, output, worker, preview
     properties.unregister()
+    batch.unregister()
+    output.unregister()
+    worker.shutdown_worker()
+    preview.free_preview_data()
     bpy.utils.unregister_class(MitsubaRenderEngine)
     for panel in get_panels():
         if 'MITSUBA' in panel.COMPAT_ENGINES:
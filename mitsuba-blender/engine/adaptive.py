@@ -0,0 +1,87 @@
+import numpy as np
+
+class AdaptiveSampling:
+    '''
+    Decide how many sample batches to render, given a wall-clock budget
+    and/or a target relative error.
+
+    The error is estimated from the spread of the independent batch films:
+    each batch is an unbiased estimate of the image, so the variance of
+    their weighted mean follows from their weighted sample variance.
+
+    Params
+    ------
+
+    max_spp: Maximum sample count, never exceeded
+    batch_spp: Sample count of each batch
+    time_budget: Render time budget in seconds, or 0 for none
+    noise_threshold: Target mean relative error of the pixels, or 0 for none
+    '''
+    # Added to pixel values, so that dark pixels don't dominate the relative error
+    luminance_epsilon = 1e-2
+
+    def __init__(self, max_spp, batch_spp, time_budget=0.0, noise_threshold=0.0):
+        self.max_spp = max_spp
+        self.batch_spp = max(1, batch_spp)
+        self.time_budget = time_budget
+        self.noise_threshold = noise_threshold
+        self.spp = 0
+        self.batch_count = 0
+        self.elapsed = 0.0
+        # Weighted running mean and sum of squared deviations of the batch luminances
+        self.mean = None
+        self.deviation = None
+
+    def passes(self):
+        '''
+        Yield the sample count of the next batch until a stopping criterion is met.
+        Each batch needs to be recorded with add() before the next one is drawn.
+        '''
+        while self.spp < self.max_spp and not self.converged():
+            yield min(self.batch_spp, self.max_spp - self.spp)
+
+    def add(self, pixels, spp, seconds):
+        '''
+        Record a batch
+
+        Params
+        ------
+
+        pixels: Film of the batch alone, of shape (height, width, channels), RGB first
+        spp: Sample count of the batch
+        seconds: Time spent rendering it
+        '''
+        luminance = pixels[..., 0] * 0.2126 + pixels[..., 1] * 0.7152 + pixels[..., 2] * 0.0722
+        self.batch_count += 1
+        self.elapsed += seconds
+        self.spp += spp
+        if self.mean is None:
+            self.mean = luminance.astype(np.float64)
+            self.deviation = np.zeros_like(self.mean)
+        else:
+            delta = luminance - self.mean
+            self.mean += (spp / self.spp) * delta
+            self.deviation += spp * delta * (luminance - self.mean)
+
+    def error(self):
+        '''
+        Estimated mean relative error of the pixels of the accumulated image
+        '''
+        if self.batch_count < 2:
+            return float('inf')
+        variance = self.deviation / ((self.batch_count - 1) * self.spp)
+        return float(np.mean(np.sqrt(variance) / (np.abs(self.mean) + self.luminance_epsilon)))
+
+    def converged(self):
+        if self.noise_threshold > 0 and self.error() <= self.noise_threshold:
+            return True
+        if self.time_budget > 0 and self.batch_count > 0:
+            # Stop if the next batch is expected to exceed the budget
+            return self.elapsed * (self.batch_count + 1) / self.batch_count > self.time_budget
+        return False
+
+    def progress(self):
+        progress = self.spp / self.max_spp
+        if self.time_budget > 0:
+            progress = max(progress, self.elapsed / self.time_budget)
+        return min(progress, 1.0)
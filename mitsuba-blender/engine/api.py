@@ -0,0 +1,51 @@
+'''
+Render Blender scenes from Python scripts, without going through render
+operators or files on disk:
+
+    import importlib
+    api = importlib.import_module('mitsuba-blender.engine.api')
+    passes = api.render_depsgraph(bpy.context.evaluated_depsgraph_get(), spp=64, aovs=['albedo:albedo'])
+    image, albedo = passes['Main'], passes['albedo']
+'''
+import numpy as np
+from ..io.exporter import SceneConverter
+from .final import film_passes, apply_thread_settings
+
+def render_depsgraph(depsgraph, spp=None, aovs=None, seed=0):
+    '''
+    Render the active camera of a depsgraph in memory. Meshes and textures are
+    handed over to Mitsuba directly: nothing is written to disk and no Blender
+    image is created.
+    Returns a dict of render pass name -> float32 array of shape (height, width, channels).
+    The image itself is the 'Main' pass.
+
+    Params
+    ------
+
+    depsgraph: Evaluated depsgraph of the scene to render
+    spp: Sample count, defaults to the sample count of the scene
+    aovs: AOVs to render along with the image, as 'name:type' strings (e.g. 'dd.y:depth')
+    seed: Seed of the sampler
+    '''
+    from mitsuba import set_variant, ScopedSetThreadEnvironment
+    b_scene = depsgraph.scene
+    set_variant(b_scene.mitsuba.variant)
+    apply_thread_settings(b_scene)
+    with ScopedSetThreadEnvironment(b_scene.thread_env):
+        converter = SceneConverter(render=True)
+        converter.export_ctx.write_textures = False
+        converter.aovs = aovs
+        converter.scene_to_dict(depsgraph)
+        mts_scene = converter.dict_to_scene()
+        del converter
+
+        sensor = mts_scene.sensors()[0]
+        if spp is None:
+            spp = sensor.sampler().sample_count()
+        mts_scene.integrator().render(mts_scene, sensor, seed=seed, spp=spp)
+        bitmap = sensor.film().bitmap()
+        channel_names = [field.name for field in bitmap.struct_()]
+        width, height = bitmap.size()
+        pixels = np.asarray(bitmap, dtype=np.float32).reshape(height, width, -1)
+        return {name: np.array(pixels[..., start:start + channel_count])
+                for (name, start, channel_count, _) in film_passes(channel_names)}
@@ -0,0 +1,119 @@
+import bpy
+import os
+import tempfile
+from bpy.props import EnumProperty, StringProperty
+from bpy.types import Operator
+
+from ..io.exporter import SceneConverter
+from .final import apply_thread_settings
+
+def batch_cameras(context, camera_source):
+    '''
+    Return the names of the cameras to render in a batch
+
+    Params
+    ------
+
+    context: Blender context
+    camera_source: 'ALL' for all cameras of the scene, 'SELECTED' for the
+                   selected ones and 'MARKERS' for the cameras bound to
+                   timeline markers
+    '''
+    b_scene = context.scene
+    if camera_source == 'SELECTED':
+        cameras = [obj for obj in context.selected_objects if obj.type == 'CAMERA']
+    elif camera_source == 'MARKERS':
+        cameras = [marker.camera for marker in b_scene.timeline_markers if marker.camera is not None]
+    else:
+        cameras = [obj for obj in b_scene.objects if obj.type == 'CAMERA']
+    # Remove duplicates, keeping the order
+    return list(dict.fromkeys(camera.name_full for camera in cameras))
+
+class MITSUBA_OT_render_cameras(Operator):
+    '''
+    Render the scene from several cameras, loading it only once
+    '''
+    bl_idname = 'mitsuba.render_cameras'
+    bl_label = 'Render Cameras with Mitsuba'
+    bl_description = 'Render the scene from several cameras with Mitsuba, loading it only once, and save each render as an EXR file'
+
+    camera_source : EnumProperty(
+        name = 'Cameras',
+        items = (
+            ('ALL', 'All Cameras', 'Render all the cameras of the scene'),
+            ('SELECTED', 'Selected Cameras', 'Render the selected cameras'),
+            ('MARKERS', 'Marker Cameras', 'Render the cameras bound to timeline markers'),
+        ),
+        default = 'ALL'
+    )
+
+    output_dir : StringProperty(
+        name = 'Output Directory',
+        description = 'Directory in which to save the renders, one EXR file per camera',
+        default = '//renders/',
+        subtype = 'DIR_PATH'
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene is not None
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        from mitsuba import set_variant
+        b_scene = context.scene
+        cameras = batch_cameras(context, self.camera_source)
+        if len(cameras) == 0:
+            self.report({'ERROR'}, 'No camera to render.')
+            return {'CANCELLED'}
+
+        output_dir = bpy.path.abspath(self.output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+        if b_scene.render.engine == 'MITSUBA':
+            set_variant(b_scene.mitsuba.variant)
+        apply_thread_settings(b_scene)
+        from mitsuba import ScopedSetThreadEnvironment, Thread
+        window_manager = context.window_manager
+        with ScopedSetThreadEnvironment(b_scene.thread_env):
+            with tempfile.TemporaryDirectory() as dummy_dir:
+                converter = SceneConverter(render=True)
+                converter.cameras = set(cameras)
+                converter.auto_instancing = b_scene.mitsuba.use_auto_instancing
+                # Sensors are identified by the name of their camera
+                converter.export_ctx.export_ids = True
+                converter.set_path(os.path.join(dummy_dir, 'scene.xml'))
+                converter.scene_to_dict(context.evaluated_depsgraph_get())
+                Thread.thread().file_resolver().prepend(dummy_dir)
+                mts_scene = converter.dict_to_scene()
+
+            sensors = {sensor.id(): sensor for sensor in mts_scene.sensors()}
+            integrator = mts_scene.integrator()
+            window_manager.progress_begin(0, len(cameras))
+            for index, camera_name in enumerate(cameras):
+                sensor = sensors.get(camera_name)
+                if sensor is None:
+                    self.report({'WARNING'}, f'Camera \'{camera_name}\' could not be exported. Skipping it.')
+                    continue
+                integrator.render(mts_scene, sensor)
+                filepath = os.path.join(output_dir, f'{bpy.path.clean_name(camera_name)}.exr')
+                sensor.film().bitmap().write(filepath)
+                window_manager.progress_update(index + 1)
+            window_manager.progress_end()
+
+        self.report({'INFO'}, f'Rendered {len(cameras)} camera(s) to {output_dir}.')
+        return {'FINISHED'}
+
+def menu_render_func(self, context):
+    self.layout.separator()
+    self.layout.operator(MITSUBA_OT_render_cameras.bl_idname, icon='OUTLINER_OB_CAMERA')
+
+def register():
+    bpy.utils.register_class(MITSUBA_OT_render_cameras)
+    bpy.types.TOPBAR_MT_render.append(menu_render_func)
+
+def unregister():
+    bpy.utils.unregister_class(MITSUBA_OT_render_cameras)
+    bpy.types.TOPBAR_MT_render.remove(menu_render_func)
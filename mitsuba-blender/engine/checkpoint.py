@@ -0,0 +1,46 @@
+import os
+import zipfile
+import numpy as np
+
+def checkpoint_path(directory, fingerprint):
+    '''
+    Return the path of the checkpoint of the scene with the given fingerprint
+    '''
+    return os.path.join(directory, f'{fingerprint}.npz')
+
+def save_checkpoint(filepath, pixels, spp, seed_offset, channel_names):
+    '''
+    Save an accumulated film, so that more samples can be added to it later
+
+    Params
+    ------
+
+    filepath: Path of the checkpoint file
+    pixels: Accumulated film, of shape (height, width, channels)
+    spp: Sample count of the accumulated film
+    seed_offset: Seed of the next sample pass
+    channel_names: Names of the channels of the film
+    '''
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    # Write to a temporary file first, so that an interrupted save doesn't corrupt the previous checkpoint
+    temp_path = f'{filepath}.tmp.npz'
+    np.savez(temp_path, pixels=pixels, spp=spp, seed_offset=seed_offset, channel_names=np.array(channel_names))
+    os.replace(temp_path, filepath)
+
+def load_checkpoint(filepath):
+    '''
+    Load a checkpoint saved by save_checkpoint.
+    Returns a dict with the same entries, or None if there is no valid checkpoint.
+    '''
+    if not os.path.isfile(filepath):
+        return None
+    try:
+        with np.load(filepath) as data:
+            return {
+                'pixels': data['pixels'].astype(np.float32, copy=False),
+                'spp': int(data['spp']),
+                'seed_offset': int(data['seed_offset']),
+                'channel_names': [str(name) for name in data['channel_names']],
+            }
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
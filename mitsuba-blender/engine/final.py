@@ -1,14 +1,126 @@
 import bpy
+import hashlib
 import tempfile
 import os
+import threading
 import numpy as np
 from ..io.exporter import SceneConverter
+from ..io.exporter.export_context import PluginCache
+from .progressive import sample_pass_schedule, FilmAccumulator
+from ..io.exporter.disk_cache import DiskCache
+from ..io.exporter.fingerprint import scene_fingerprint, referenced_files, update_file_hash
+from .adaptive import AdaptiveSampling
+from .checkpoint import checkpoint_path, load_checkpoint, save_checkpoint
+from .stats import PhaseTimer, format_rate, record_variant_rate, variant_rates_summary
+from .viewport import ViewportScene, ViewportDrawData
+from .preview import get_preview_data
+from .output import get_exr_writer, direct_output_path
+from .worker import get_worker, get_workers, render_distributed, split_samples
+
+def film_passes(channel_names):
+    '''
+    Group the channels of a developed film into render passes, the same way
+    Bitmap.split() does, without splitting the film itself.
+    Returns a list of (pass name, first channel, channel count, channel IDs).
+    '''
+    passes = []
+    for index, channel_name in enumerate(channel_names):
+        prefix, _, channel_id = channel_name.rpartition('.')
+        pass_name = prefix if prefix else "Main"
+        if passes and passes[-1][0] == pass_name:
+            passes[-1][2] += 1
+            passes[-1][3] += channel_id
+        else:
+            passes.append([pass_name, index, 1, channel_id])
+    return passes
+
+def band_windows(crop_x, crop_y, crop_width, crop_height, band_height):
+    '''
+    Split a crop window of the film into horizontal bands of at most
+    band_height rows, from top to bottom.
+    Returns a list of (x, y, width, height) crop windows.
+    '''
+    return [(crop_x, y, crop_width, min(band_height, crop_y + crop_height - y))
+            for y in range(crop_y, crop_y + crop_height, max(1, band_height))]
+
+def window_time_budget(time_budget, elapsed, remaining_windows):
+    '''
+    Share what is left of the render time budget of a frame among the windows
+    still to render, so that banded renders keep to the budget of the frame.
+    Once the budget is spent, windows still get a small positive one, as 0
+    means no limit: adaptive sampling then renders a single batch of each.
+
+    Params
+    ------
+
+    time_budget: Render time budget of the frame in seconds, or 0 for none
+    elapsed: Render time spent on the previous windows
+    remaining_windows: Windows still to render, including the current one
+    '''
+    if time_budget <= 0:
+        return 0.0
+    return max(time_budget - elapsed, 1e-3) / remaining_windows
+
+def result_rect(film_window, window):
+    '''
+    Return the rectangle of the render result a window of the film is written
+    to, as (x, y, width, height). With a render border, Blender's render
+    result only covers the border and starts at its bottom-left corner.
+
+    Params
+    ------
+
+    film_window: Crop window of the film, i.e. the render border if enabled, as (x, y, width, height)
+    window: Window of the film within film_window, as (x, y, width, height)
+    '''
+    film_x, film_y, _, film_height = film_window
+    x, y, width, height = window
+    # Blender's rows start at the bottom, Mitsuba's at the top
+    return (x - film_x, film_y + film_height - y - height, width, height)
+
+def film_crop_window(film):
+    '''
+    Return the crop window of a film dict, as (x, y, width, height)
+    '''
+    crop_x = film.get('crop_offset_x', 0)
+    crop_y = film.get('crop_offset_y', 0)
+    return (crop_x, crop_y, film.get('crop_width', film['width'] - crop_x), film.get('crop_height', film['height'] - crop_y))
+
+def canonical_channel_order(channel_names):
+    '''
+    Return the indices of the channels of a film sorted in a fixed order:
+    channels without a prefix first, then by prefix, with the components of
+    each prefix in RGBA/XYZ/UV order. Image files such as OpenEXR may store
+    the channels of a film in a different order than Mitsuba develops them.
+    '''
+    component_order = 'RGBAXYZUVWT'
+    def sort_key(index):
+        prefix, _, component = channel_names[index].rpartition('.')
+        position = component_order.find(component) if len(component) == 1 else -1
+        return (prefix != '', prefix, position if position >= 0 else len(component_order), component)
+    return sorted(range(len(channel_names)), key=sort_key)
+
+def apply_thread_settings(b_scene):
+    '''
+    Resize Mitsuba's worker pool to the thread count of the render settings.
+    Blender resolves it from the thread mode, or from the -t command line
+    option for background renders.
+    '''
+    import drjit as dr
+    thread_count = b_scene.render.threads
+    if dr.thread_count() != thread_count:
+        dr.set_thread_count(thread_count)
 
 class MitsubaRenderEngine(bpy.types.RenderEngine):
 
     bl_idname = "MITSUBA"
     bl_label = "Mitsuba"
-    bl_use_preview = False
+    bl_use_preview = True
+
+    # Delay between two checks for a user cancellation while a pass is rendering, in seconds
+    test_break_interval = 0.1
+    # Sample count of material, world and light previews
+    preview_samples = 16
 
     # Init is called whenever a new render engine instance is created. Multiple
     # instances may exist at the same time, for example for a viewport and final
@@ -16,12 +128,33 @@ class MitsubaRenderEngine(bpy.types.RenderEngine):
     def __init__(self):
         self.scene_data = None
         self.draw_data = None
-        self.converter = SceneConverter(render=True)
+        self.converter = None
+        self.result_buffer = None # Scratch buffer for writing render passes
+        self.render_passes = None
+        self.sensor_dict = None
+        self.scene_fingerprint = None # Identifies the checkpoints of the scene
+        self.result_key = None # Identifies the cached results of the scene
+        self.cached_windows = None
+        self.film_window = None # Crop window of the film, the origin of the render result
+        # Persistent data, kept alive across renders
+        self.plugin_cache = None
+        self.persistent_variant = None
+        self.texture_dir = None
 
     # When the render engine instance is destroy, this is called. Clean up any
     # render engine data here, for example stopping running render threads.
     def __del__(self):
-        pass
+        if getattr(self, 'scene_data', None) is not None:
+            self.scene_data.free()
+            self.scene_data = None
+        self.draw_data = None
+        self.free_persistent_data()
+
+    def free_persistent_data(self):
+        self.plugin_cache = None
+        if getattr(self, 'texture_dir', None) is not None:
+            self.texture_dir.cleanup()
+            self.texture_dir = None
 
     # This is the method called by Blender for both final renders (F12) and
     # small preview for materials, world and lights.
@@ -29,40 +162,572 @@ class MitsubaRenderEngine(bpy.types.RenderEngine):
         from mitsuba import set_variant
         b_scene = depsgraph.scene
         set_variant(b_scene.mitsuba.variant)
+        apply_thread_settings(b_scene)
         from mitsuba import ScopedSetThreadEnvironment, Thread
         with ScopedSetThreadEnvironment(b_scene.thread_env):
+            timer = PhaseTimer()
             scale = b_scene.render.resolution_percentage / 100.0
             self.size_x = int(b_scene.render.resolution_x * scale)
             self.size_y = int(b_scene.render.resolution_y * scale)
 
-            # Temporary workaround as long as the dict creation writes stuff to dict
-            with tempfile.TemporaryDirectory() as dummy_dir:
-                filepath = os.path.join(dummy_dir, "scene.xml")
-                self.converter.set_path(filepath)
-                self.converter.scene_to_dict(depsgraph)
-                Thread.thread().file_resolver().prepend(dummy_dir)
-                mts_scene = self.converter.dict_to_scene()
+            if self.is_preview:
+                self.render_preview(depsgraph)
+                return
+
+            # Report the failed writes of the previous frames
+            for error in get_exr_writer().pop_errors():
+                self.report({'ERROR'}, error)
+
+            if b_scene.mitsuba.use_worker:
+                self.free_persistent_data()
+                self.render_in_worker(depsgraph, timer)
+                return
+
+            # Meshes are kept in memory, but textures still need to be written to disk
+            if b_scene.render.use_persistent_data:
+                if self.plugin_cache is not None and self.persistent_variant != b_scene.mitsuba.variant:
+                    # Plugins cannot be shared between variants
+                    self.free_persistent_data()
+                if self.plugin_cache is None:
+                    self.plugin_cache = PluginCache()
+                    self.persistent_variant = b_scene.mitsuba.variant
+                    # Exported textures are reused by the next renders
+                    self.texture_dir = tempfile.TemporaryDirectory()
+                    Thread.thread().file_resolver().prepend(self.texture_dir.name)
+                mts_scene = self.load_scene(depsgraph, self.texture_dir.name, timer)
+            else:
+                self.free_persistent_data()
+                with tempfile.TemporaryDirectory() as dummy_dir:
+                    Thread.thread().file_resolver().prepend(dummy_dir)
+                    mts_scene = self.load_scene(depsgraph, dummy_dir, timer)
+
+            if mts_scene is None:
+                # The result of this exact scene is already cached
+                self.converter = None
+                self.write_cached_windows(b_scene, timer)
+                return
+
+            if self.test_break():
+                self.converter = None
+                return
+            texture_count = len(self.converter.export_ctx.exported_textures)
 
             sensor = mts_scene.sensors()[0]
-            mts_scene.integrator().render(mts_scene, sensor)
-            render_results = sensor.film().bitmap().split()
-
-            for result in render_results:
-                buf_name = result[0].replace("<root>", "Main")
-                channel_count = result[1].channel_count() if result[1].channel_count() != 2 else 3
-
-                self.add_pass(buf_name, channel_count, ''.join([f.name.split('.')[-1] for f in result[1].struct_()]))
-
-            blender_result = self.begin_result(0, 0, self.size_x, self.size_y)
-
-            for result in render_results:
-                render_pixels = np.array(result[1])
-                if result[1].channel_count() == 2:
-                    # Add a dummy third channel
-                    render_pixels = np.dstack((render_pixels, np.zeros((*render_pixels.shape[:2], 1))))
-                #render_pixels = np.array(render.convert(Bitmap.PixelFormat.RGBA, Struct.Type.Float32, srgb_gamma=False))
-                # Here we write the pixel values to the RenderResult
-                buf_name = result[0].replace("<root>", "Main")
-                layer = blender_result.layers[0].passes[buf_name]
-                layer.rect = np.flip(render_pixels, 0).reshape((self.size_x*self.size_y, -1))
+            spp = sensor.sampler().sample_count()
+            # Only the crop window of the film (e.g. the border region) is rendered
+            crop_x, crop_y = sensor.film().crop_offset()
+            crop_width, crop_height = sensor.film().crop_size()
+            self.film_window = (crop_x, crop_y, crop_width, crop_height)
+            mts_settings = b_scene.mitsuba
+            windows = self.render_windows(mts_settings, self.film_window)
+
+            self.render_passes = None
+            samples = 0 # Samples rendered by this render
+            total_samples = 0 # Including the samples of resumed checkpoints
+            errors = []
+            render_start = timer.get('Render')
+            for window_index, window in enumerate(windows):
+                if len(windows) > 1:
+                    # Only the film of the current band is allocated
+                    sensor = self.band_sensor(window)
+
+                checkpoint = None
+                checkpoint_file = None
+                if mts_settings.use_checkpoints:
+                    checkpoint_file = checkpoint_path(bpy.path.abspath(mts_settings.checkpoint_dir),
+                                                      '-'.join(map(str, (self.scene_fingerprint, *window))))
+                    if mts_settings.checkpoint_resume:
+                        checkpoint = load_checkpoint(checkpoint_file)
+                        if checkpoint is not None and checkpoint['pixels'].shape[:2] != (window[3], window[2]):
+                            checkpoint = None
+                resumed_spp = checkpoint['spp'] if checkpoint is not None else 0
+
+                time_budget = window_time_budget(mts_settings.adaptive_time_budget, timer.get('Render') - render_start,
+                                                 len(windows) - window_index)
+                accumulator, adaptive, seed_offset = self.render_window(b_scene, mts_scene, sensor, window, spp, timer,
+                                                                        progress=(window_index, len(windows)),
+                                                                        checkpoint=checkpoint,
+                                                                        time_budget=time_budget)
+                samples += (accumulator.spp - resumed_spp) * window[2] * window[3]
+                total_samples += accumulator.spp * window[2] * window[3]
+                if adaptive is not None:
+                    errors.append(adaptive.error())
+                if checkpoint_file is not None and accumulator.spp > resumed_spp:
+                    save_checkpoint(checkpoint_file, accumulator.pixels(), accumulator.spp, seed_offset, accumulator.channel_names)
+                if self.test_break():
+                    break
+                if self.result_key is not None:
+                    # Only complete renders are cached
+                    bitmap = accumulator.bitmap()
+                    self.result_cache(mts_settings).put(self.window_key(window), bitmap.write)
+                    del bitmap
+                if mts_settings.use_direct_output:
+                    # Written in the background, while the next frame is exported and rendered
+                    output_path = direct_output_path(b_scene, window if len(windows) > 1 else None)
+                    get_exr_writer().submit(b_scene.thread_env, accumulator.bitmap(), output_path,
+                                            mts_settings.direct_output_half)
+                del accumulator
+
+            spp_used = round(total_samples / (crop_width * crop_height))
+            triangle_count = sum(shape.primitive_count() for shape in mts_scene.shapes() if shape.is_mesh())
+            # Free the Mitsuba scene before handing control back to Blender
+            self.converter = None
+            del mts_scene, sensor
+
+            # Saved in the metadata of the render result
+            self.stamp_data_add_field('Mitsuba Timings', timer.summary())
+            self.stamp_data_add_field('Mitsuba Samples', f"{samples} ({format_rate(samples, timer.get('Render'))})")
+            self.stamp_data_add_field('Mitsuba SPP', str(spp_used))
+            self.stamp_data_add_field('Mitsuba Variant', b_scene.mitsuba.variant)
+            if errors:
+                self.stamp_data_add_field('Mitsuba Relative Error', f'{max(errors):.4f}')
+            self.stamp_data_add_field('Mitsuba Triangles', str(triangle_count))
+            self.stamp_data_add_field('Mitsuba Textures', str(texture_count))
+            # Compare with the throughput of the other variants
+            record_variant_rate(b_scene.mitsuba.variant, samples, timer.get('Render'))
+            self.update_stats('', f"{timer.summary()} | {spp_used} spp | {variant_rates_summary(b_scene.mitsuba.variant)}")
+
+    def render_windows(self, mts_settings, crop_window):
+        '''
+        Split the crop window of the film into the windows to render one after the other
+        '''
+        if mts_settings.use_bands:
+            return band_windows(*crop_window, mts_settings.band_height)
+        return [crop_window]
+
+    def result_cache(self, mts_settings):
+        return DiskCache(bpy.path.abspath(mts_settings.result_cache_dir),
+                         int(mts_settings.result_cache_size * 1024**3), suffix='.exr')
+
+    def result_cache_key(self, b_scene, directory):
+        '''
+        Hash everything the render result depends on: the scene dict, the
+        content of the files it references and the render settings
+        '''
+        scene_data = self.converter.export_ctx.scene_data
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(scene_fingerprint(scene_data, ignore_sample_count=False).encode())
+        for filename in sorted(set(referenced_files(scene_data))):
+            hasher.update(filename.encode())
+            filepath = os.path.join(directory, filename)
+            if os.path.isfile(filepath):
+                update_file_hash(hasher, filepath)
+        mts_settings = b_scene.mitsuba
+        settings = (mts_settings.variant, mts_settings.use_adaptive)
+        if mts_settings.use_adaptive:
+            settings += (mts_settings.adaptive_batch_spp, mts_settings.adaptive_time_budget, mts_settings.adaptive_noise_threshold)
+        hasher.update(repr(settings).encode())
+        return hasher.hexdigest()
+
+    def window_key(self, window):
+        return '-'.join(map(str, (self.result_key, *window)))
+
+    def write_cached_windows(self, b_scene, timer):
+        '''
+        Write the cached results of all the windows of the film to the render
+        result, and to the direct output files if enabled
+        '''
+        from mitsuba import Bitmap
+        mts_settings = b_scene.mitsuba
+        self.render_passes = None
+        for window, filepath in self.cached_windows:
+            crop_width, crop_height = window[2:]
+            with timer.phase('Write'):
+                bitmap = Bitmap(filepath)
+                channel_names = [field.name for field in bitmap.struct_()]
+                order = canonical_channel_order(channel_names)
+                pixels = np.asarray(bitmap, dtype=np.float32).reshape(crop_height, crop_width, -1)[..., order]
+                if self.render_passes is None:
+                    self.render_passes = film_passes([channel_names[index] for index in order])
+                    if mts_settings.use_direct_output:
+                        # Same passes as rendered frames
+                        self.render_passes = self.render_passes[:1]
+                    self.add_passes(self.render_passes)
+                blender_result = self.begin_result(*result_rect(self.film_window, window))
+                self.write_results(blender_result, pixels, self.render_passes)
+                self.end_result(blender_result)
+                del pixels
+            if mts_settings.use_direct_output:
+                # Written again rather than copied, the half float setting may differ
+                output_path = direct_output_path(b_scene, window if len(self.cached_windows) > 1 else None)
+                get_exr_writer().submit(b_scene.thread_env, bitmap, output_path, mts_settings.direct_output_half)
+            del bitmap
+        self.cached_windows = None
+        self.stamp_data_add_field('Mitsuba Result Cache', self.result_key)
+        self.update_stats('', f'Loaded from the result cache | {timer.summary()}')
+
+    def band_sensor(self, window):
+        '''
+        Create a sensor rendering only the given window of the film
+        '''
+        from mitsuba import load_dict
+        crop_x, crop_y, crop_width, crop_height = window
+        sensor_dict = dict(self.sensor_dict)
+        sensor_dict['film'] = dict(sensor_dict['film'],
+                                   crop_offset_x=crop_x,
+                                   crop_offset_y=crop_y,
+                                   crop_width=crop_width,
+                                   crop_height=crop_height)
+        return load_dict(sensor_dict)
+
+    def render_window(self, b_scene, mts_scene, sensor, window, spp, timer, progress=(0, 1), checkpoint=None, time_budget=0.0):
+        '''
+        Render the crop window of a sensor in one or several sample passes,
+        and write it to its own render result.
+        Returns the accumulated film, the AdaptiveSampling instance that
+        decided the sample count with adaptive sampling, and the seed of the
+        next sample pass.
+
+        Params
+        ------
+
+        window: Crop window of the sensor's film, as (x, y, width, height)
+        spp: Sample count of the sensor
+        timer: PhaseTimer recording the time spent in each phase
+        progress: Index of the window and window count, for the progress bar
+        checkpoint: Previously accumulated film to add samples to, as loaded by load_checkpoint
+        time_budget: Render time budget of the window with adaptive sampling, in seconds, or 0 for none
+        '''
+        accumulator = FilmAccumulator()
+        seed_offset = 0
+        if checkpoint is not None:
+            accumulator.load(checkpoint['pixels'], checkpoint['spp'], checkpoint['channel_names'])
+            seed_offset = checkpoint['seed_offset']
+        remaining_spp = max(0, spp - accumulator.spp)
+
+        mts_settings = b_scene.mitsuba
+        adaptive = None
+        if remaining_spp == 0:
+            passes = []
+        elif mts_settings.use_adaptive:
+            # The sample count of the sampler is the maximum
+            adaptive = AdaptiveSampling(remaining_spp, mts_settings.adaptive_batch_spp,
+                                        time_budget, mts_settings.adaptive_noise_threshold)
+            passes = adaptive.passes()
+        elif mts_settings.use_progressive:
+            passes = sample_pass_schedule(remaining_spp, mts_settings.progressive_initial_spp, mts_settings.progressive_growth)
+        else:
+            passes = [remaining_spp]
+
+        blender_result = None
+
+        def write_result():
+            nonlocal blender_result
+            with timer.phase('Write'):
+                if blender_result is None:
+                    if self.render_passes is None:
+                        # Passes need to be declared before the first result is created
+                        self.render_passes = film_passes(accumulator.channel_names)
+                        if mts_settings.use_direct_output:
+                            # The other passes are only written to the EXR file
+                            self.render_passes = self.render_passes[:1]
+                        self.add_passes(self.render_passes)
+                    blender_result = self.begin_result(*result_rect(self.film_window, window))
+
+                self.write_results(blender_result, accumulator.pixels(), self.render_passes)
+                self.update_result(blender_result)
+
+        if accumulator.spp > 0:
+            # Show the resumed render right away
+            write_result()
+
+        for pass_index, pass_spp in enumerate(passes):
+            self.update_stats(f'Rendering {accumulator.spp + pass_spp}/{spp} spp', timer.summary())
+            render_time = timer.get('Render')
+            # Use a different seed for each pass, so that samples are not correlated
+            with timer.phase('Render'):
+                if not self.render_pass(b_scene, mts_scene, sensor, seed_offset, pass_spp):
+                    break
+            seed_offset += 1
+            render_time = timer.get('Render') - render_time
+            # Develop the film once, passes are written from views of it
+            with timer.phase('Develop'):
+                bitmap = sensor.film().bitmap()
+                accumulator.add(bitmap, pass_spp)
+                if adaptive is not None:
+                    adaptive.add(np.asarray(bitmap, dtype=np.float32).reshape(accumulator.pixels().shape), pass_spp, render_time)
+                del bitmap
+
+            write_result()
+            window_progress = adaptive.progress() if adaptive is not None else accumulator.spp / spp
+            self.update_progress((progress[0] + window_progress) / progress[1])
+
+            if self.test_break():
+                break
+
+        if blender_result is not None:
             self.end_result(blender_result)
+        return accumulator, adaptive, seed_offset
+
+    def render_preview(self, depsgraph):
+        '''
+        Render a material, world or light preview at a low fixed sample count.
+        Plugins that did not change since the previous preview, e.g. the
+        preview meshes or the floor material, are reused.
+        '''
+        from mitsuba import Bitmap, Struct
+        b_scene = depsgraph.scene
+        preview_data = get_preview_data(b_scene.mitsuba.variant)
+        converter = SceneConverter(render=True)
+        # The preview scene is not the one being edited, the interaction mode must not change
+        converter.switch_to_object_mode = False
+        converter.export_ctx.export_ids = True
+        converter.export_ctx.plugin_cache = preview_data.plugin_cache
+        converter.set_path(os.path.join(preview_data.texture_dir.name, "scene.xml"))
+        converter.scene_to_dict(depsgraph)
+        mts_scene = converter.dict_to_scene()
+        if self.test_break():
+            return
+
+        sensor = mts_scene.sensors()[0]
+        if not self.render_pass(b_scene, mts_scene, sensor, 0, self.preview_samples):
+            return
+        # Previews only display the combined pass
+        bitmap = sensor.film().bitmap().split()[0][1]
+        pixels = np.array(bitmap.convert(Bitmap.PixelFormat.RGBA, Struct.Type.Float32, srgb_gamma=False), copy=False)
+        blender_result = self.begin_result(0, 0, self.size_x, self.size_y)
+        blender_result.layers[0].passes["Combined"].rect.foreach_set(np.ascontiguousarray(pixels[::-1]).ravel())
+        self.end_result(blender_result)
+
+    def render_in_worker(self, depsgraph, timer):
+        '''
+        Export the scene as an XML file and render it in the render worker,
+        or in several workers that each render a subset of the samples.
+        Films are written to the render result as they are streamed back.
+        '''
+        b_scene = depsgraph.scene
+        mts_settings = b_scene.mitsuba
+        with tempfile.TemporaryDirectory() as export_dir:
+            self.update_stats('Exporting scene', timer.summary())
+            with timer.phase('Export'):
+                converter = SceneConverter(render=True)
+                # The worker loads the scene from disk
+                converter.export_ctx.write_meshes = True
+                converter.auto_instancing = b_scene.mitsuba.use_auto_instancing
+                converter.set_path(os.path.join(export_dir, "scene.xml"))
+                converter.scene_to_dict(depsgraph)
+                converter.dict_to_xml()
+            if self.test_break():
+                return
+
+            request = {
+                'cmd': 'render',
+                'xml': os.path.join(export_dir, "scene.xml"),
+                'variant': mts_settings.variant,
+                'threads': b_scene.render.threads,
+                'progressive': (mts_settings.progressive_initial_spp, mts_settings.progressive_growth) if mts_settings.use_progressive else None,
+            }
+            state = {'result': None}
+
+            def write_film(loaded, channels, pixels, spp):
+                with timer.phase('Write'):
+                    if state['result'] is None:
+                        # The whole crop window of the film is rendered at once
+                        window = (*loaded['crop_offset'], *loaded['crop_size'])
+                        # Passes need to be declared before the result is created
+                        state['passes'] = film_passes(channels)
+                        self.add_passes(state['passes'])
+                        state['result'] = self.begin_result(*result_rect(window, window))
+                    self.write_results(state['result'], pixels, state['passes'])
+                    self.update_result(state['result'])
+                self.update_progress(spp / state['spp'])
+                self.update_stats(f"Rendering {spp}/{state['spp']} spp", timer.summary())
+
+            def on_message(message, pixels):
+                if message['type'] == 'loaded':
+                    timer.add('Load', message['time'])
+                    state['spp'] = message['spp']
+                    state['loaded'] = message
+                    self.update_stats(f"Rendering 0/{message['spp']} spp", timer.summary())
+                elif message['type'] == 'film':
+                    timer.add('Render', message['time'])
+                    write_film(state['loaded'], message['channels'], pixels, message['spp'])
+
+            def on_merged_film(loaded, pixels, spp):
+                write_film(loaded, loaded['channels'], pixels, spp)
+
+            try:
+                if mts_settings.worker_count > 1:
+                    # Each worker renders a subset of the samples, with its own seeds
+                    sensor_dict = next(value for value in converter.export_ctx.scene_data.values()
+                                       if isinstance(value, dict) and 'film' in value)
+                    state['spp'] = sensor_dict['sampler'].get('sample_count', 4)
+                    subsets = split_samples(state['spp'], mts_settings.worker_count)
+                    requests = [dict(request,
+                                     spp=subset_spp,
+                                     seed_offset=index,
+                                     seed_stride=len(subsets),
+                                     threads=max(1, b_scene.render.threads // len(subsets)))
+                                for index, subset_spp in enumerate(subsets)]
+                    with timer.phase('Render'):
+                        render_distributed(get_workers(len(requests)), requests, self.test_break, on_merged_film)
+                else:
+                    get_worker().render(request, self.test_break, on_message)
+            except RuntimeError as e:
+                self.report({'ERROR'}, str(e))
+            finally:
+                if state['result'] is not None:
+                    self.end_result(state['result'])
+            self.update_stats('', timer.summary())
+
+    def load_scene(self, depsgraph, directory, timer):
+        '''
+        Export the scene and load it in Mitsuba. Files that still need to be
+        written, such as textures, are saved in the given directory.
+        With persistent data, plugins that did not change since the previous
+        render are reused rather than converted and loaded again.
+        The time spent in both steps is recorded in the given PhaseTimer.
+        Returns None without loading the scene if its result is cached.
+        '''
+        # Start from a fresh converter, so that nothing is left from previous renders
+        self.converter = SceneConverter(render=True)
+        self.converter.auto_instancing = depsgraph.scene.mitsuba.use_auto_instancing
+        if self.plugin_cache is not None:
+            # Cached plugins are matched by ID across renders
+            self.converter.export_ctx.export_ids = True
+            self.converter.export_ctx.plugin_cache = self.plugin_cache
+        self.converter.set_path(os.path.join(directory, "scene.xml"))
+        self.update_stats('Exporting scene', timer.summary())
+        with timer.phase('Export'):
+            self.converter.scene_to_dict(depsgraph)
+            if depsgraph.scene.mitsuba.use_checkpoints:
+                # Hashed before plugins are loaded, so that it doesn't depend on persistent data
+                self.scene_fingerprint = scene_fingerprint(self.converter.export_ctx.scene_data)
+        # Kept for banded rendering, loaded objects replace it in the scene dict
+        self.sensor_dict = next((value for value in self.converter.export_ctx.scene_data.values()
+                                 if isinstance(value, dict) and 'film' in value), None)
+
+        mts_settings = depsgraph.scene.mitsuba
+        self.result_key = None
+        # Resumed renders depend on their checkpoint
+        if mts_settings.use_result_cache and self.sensor_dict is not None and not (mts_settings.use_checkpoints and mts_settings.checkpoint_resume):
+            with timer.phase('Export'):
+                self.result_key = self.result_cache_key(depsgraph.scene, directory)
+            cache = self.result_cache(mts_settings)
+            film_window = film_crop_window(self.sensor_dict['film'])
+            windows = self.render_windows(mts_settings, film_window)
+            cached_files = [cache.get(self.window_key(window)) for window in windows]
+            if all(cached_files):
+                # No need to load the scene
+                self.film_window = film_window
+                self.cached_windows = list(zip(windows, cached_files))
+                return None
+
+        # Acceleration structures are built when loading the scene
+        self.update_stats('Loading scene', timer.summary())
+        with timer.phase('Load'):
+            return self.converter.dict_to_scene()
+
+    def render_pass(self, b_scene, mts_scene, sensor, seed, spp):
+        '''
+        Render one sample pass, while polling Blender for a user cancellation.
+        The integrator runs on a separate thread, so that it can be stopped at
+        the next block boundary. Returns False if the pass was cancelled.
+        '''
+        from mitsuba import ScopedSetThreadEnvironment
+        integrator = mts_scene.integrator()
+        thread_env = b_scene.thread_env
+        errors = []
+
+        def run():
+            try:
+                with ScopedSetThreadEnvironment(thread_env):
+                    integrator.render(mts_scene, sensor, seed=seed, spp=spp)
+            except Exception as e:
+                errors.append(e)
+
+        render_thread = threading.Thread(target=run)
+        render_thread.start()
+        cancelled = False
+        while render_thread.is_alive():
+            render_thread.join(self.test_break_interval)
+            if not cancelled and self.test_break():
+                integrator.cancel()
+                cancelled = True
+
+        if errors:
+            raise errors[0]
+        return not cancelled
+
+    def add_passes(self, render_passes):
+        for (name, _, channel_count, channel_ids) in render_passes:
+            # Blender does not support 2-channel passes, they are padded with a third one
+            self.add_pass(name, channel_count if channel_count != 2 else 3, channel_ids)
+
+    def write_results(self, blender_result, pixels, render_passes):
+        '''
+        Write a developed film of shape (height, width, channels) to the passes
+        of the render result. Rows are flipped through a strided view, and each
+        pass is gathered into a contiguous scratch buffer handed to foreach_set.
+        '''
+        height, width = pixels.shape[:2]
+        # Blender stores the bottom row first
+        pixels = pixels[::-1]
+        max_channels = max(3 if count == 2 else count for (_, _, count, _) in render_passes)
+        buffer_size = height * width * max_channels
+        if self.result_buffer is None or self.result_buffer.size != buffer_size:
+            self.result_buffer = np.empty(buffer_size, dtype=np.float32)
+
+        layer = blender_result.layers[0]
+        for (name, start, channel_count, _) in render_passes:
+            pass_channels = channel_count if channel_count != 2 else 3
+            pass_pixels = self.result_buffer[:height * width * pass_channels].reshape(height, width, pass_channels)
+            pass_pixels[..., :channel_count] = pixels[..., start:start + channel_count]
+            if pass_channels > channel_count:
+                # Dummy third channel
+                pass_pixels[..., channel_count:] = 0.0
+            # Here we write the pixel values to the RenderResult
+            layer.passes[name].rect.foreach_set(pass_pixels.ravel())
+
+    # For viewport renders, this method gets called once at the start and
+    # whenever the scene or 3D viewport changes. The loaded Mitsuba scene is
+    # kept alive and updated when possible.
+    def view_update(self, context, depsgraph):
+        from mitsuba import set_variant
+        b_scene = depsgraph.scene
+        set_variant(b_scene.mitsuba.variant)
+        apply_thread_settings(b_scene)
+        from mitsuba import ScopedSetThreadEnvironment
+        with ScopedSetThreadEnvironment(b_scene.thread_env):
+            if self.scene_data is None:
+                self.scene_data = ViewportScene(depsgraph)
+            elif not self.scene_data.update(depsgraph):
+                self.scene_data.load(depsgraph)
+
+    # For viewport renders, this method is called whenever Blender redraws the
+    # 3D viewport. Sample passes are rendered on a background thread until the
+    # viewport sample count is reached, redraws only display the latest image.
+    def view_draw(self, context, depsgraph):
+        import gpu
+        if self.scene_data is None:
+            return
+        b_scene = depsgraph.scene
+        mts_settings = b_scene.mitsuba
+        region = context.region
+        width = max(1, region.width // mts_settings.viewport_downscale)
+        height = max(1, region.height // mts_settings.viewport_downscale)
+
+        from mitsuba import ScopedSetThreadEnvironment
+        with ScopedSetThreadEnvironment(b_scene.thread_env):
+            self.scene_data.set_view(context, width, height)
+            self.scene_data.start(b_scene.thread_env, mts_settings.viewport_samples)
+        if self.scene_data.error is not None:
+            error, self.scene_data.error = self.scene_data.error, None
+            raise error
+
+        # Checked before getting the image, so that the last one is drawn once the thread is done
+        rendering = self.scene_data.is_rendering()
+        pixels, version = self.scene_data.latest_image()
+        if self.draw_data is None:
+            self.draw_data = ViewportDrawData()
+        if pixels is not None and version != self.draw_data.version:
+            self.draw_data.update(pixels, version)
+        if rendering:
+            # Redraw until the render thread is done
+            self.tag_redraw()
+
+        gpu.state.blend_set('ALPHA_PREMULT')
+        self.bind_display_space_shader(b_scene)
+        self.draw_data.draw(region.width, region.height)
+        self.unbind_display_space_shader()
+        gpu.state.blend_set('NONE')
@@ -0,0 +1,107 @@
+import bpy
+import os
+import queue
+import threading
+
+class ExrWriter:
+    '''
+    Write developed films to OpenEXR files on a background thread, so that
+    saving a frame overlaps with the export and render of the next one.
+    '''
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.errors = []
+
+    def submit(self, thread_env, bitmap, filepath, half_float=False):
+        '''
+        Queue a bitmap to be written, with all its channels
+
+        Params
+        ------
+
+        thread_env: Mitsuba thread environment, needed to use Mitsuba on the writer thread
+        bitmap: The bitmap to write. It must not be modified afterwards.
+        filepath: Path of the EXR file
+        half_float: Store the channels as 16-bit floats instead of 32-bit ones
+        '''
+        with self.lock:
+            self.queue.put((thread_env, bitmap, filepath, half_float))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='Mitsuba EXR writer')
+                self.thread.start()
+
+    def run(self):
+        from mitsuba import ScopedSetThreadEnvironment, Struct
+        while True:
+            try:
+                thread_env, bitmap, filepath, half_float = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                # Stop once idle, the thread is started again by the next submission
+                with self.lock:
+                    if self.queue.empty():
+                        self.thread = None
+                        return
+                continue
+            try:
+                with ScopedSetThreadEnvironment(thread_env):
+                    if half_float:
+                        bitmap = bitmap.convert(bitmap.pixel_format(), Struct.Type.Float16, False)
+                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                    bitmap.write(filepath)
+            except Exception as e:
+                self.errors.append(f'Failed to write {filepath}: {e}')
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        '''
+        Wait until all the queued bitmaps are written
+        '''
+        self.queue.join()
+
+    def pop_errors(self):
+        errors, self.errors = self.errors, []
+        return errors
+
+# Render engine instances may be created for each frame, the writer is shared by all of them
+_exr_writer = None
+
+def get_exr_writer():
+    global _exr_writer
+    if _exr_writer is None:
+        _exr_writer = ExrWriter()
+    return _exr_writer
+
+def flush_exr_writer():
+    '''
+    Wait until all the frames queued for writing are on disk
+    '''
+    if _exr_writer is not None:
+        _exr_writer.flush()
+
+def direct_output_path(b_scene, window=None):
+    '''
+    Return the path of the EXR file of the current frame, next to Blender's output.
+    Windows of banded renders are written to separate files.
+    The name differs from Blender's own output, which may be an EXR file too.
+    '''
+    filepath = os.path.splitext(b_scene.render.frame_path(frame=b_scene.frame_current))[0] + '_mitsuba'
+    if window is not None:
+        filepath += f'_y{window[1]}'
+    return f'{filepath}.exr'
+
+@bpy.app.handlers.persistent
+def render_finished(scene, *args):
+    # Blender considers the render done once this returns, so the files must be on disk
+    flush_exr_writer()
+
+def register():
+    bpy.app.handlers.render_complete.append(render_finished)
+    bpy.app.handlers.render_cancel.append(render_finished)
+
+def unregister():
+    bpy.app.handlers.render_complete.remove(render_finished)
+    bpy.app.handlers.render_cancel.remove(render_finished)
+    flush_exr_writer()
@@ -0,0 +1,42 @@
+import tempfile
+
+from ..io.exporter.export_context import PluginCache
+
+class PreviewData:
+    '''
+    Plugins and textures kept alive across material, world and light preview
+    renders. Preview scenes are small and mostly identical from one preview
+    to the next, so only what changed, usually the previewed material, is
+    loaded again.
+    '''
+    def __init__(self, variant):
+        from mitsuba import Thread
+        self.variant = variant
+        self.plugin_cache = PluginCache()
+        self.texture_dir = tempfile.TemporaryDirectory()
+        Thread.thread().file_resolver().prepend(self.texture_dir.name)
+
+    def free(self):
+        self.plugin_cache = None
+        self.texture_dir.cleanup()
+
+# Render engine instances are created for each preview, the data is shared by all of them
+_preview_data = None
+
+def get_preview_data(variant):
+    '''
+    Return the preview data for the given variant, creating it if needed
+    '''
+    global _preview_data
+    if _preview_data is not None and _preview_data.variant != variant:
+        # Plugins cannot be shared between variants
+        free_preview_data()
+    if _preview_data is None:
+        _preview_data = PreviewData(variant)
+    return _preview_data
+
+def free_preview_data():
+    global _preview_data
+    if _preview_data is not None:
+        _preview_data.free()
+        _preview_data = None
@@ -0,0 +1,85 @@
+import numpy as np
+
+def sample_pass_schedule(spp, initial_spp=1, growth=4):
+    '''
+    Split a total sample count into passes of geometrically increasing size,
+    e.g. 1, 4, 16, ... The last pass is clamped so that the sample counts of
+    all passes add up to the requested total.
+
+    Params
+    ------
+
+    spp: Total sample count
+    initial_spp: Sample count of the first pass
+    growth: Ratio between the sample counts of two consecutive passes
+    '''
+    passes = []
+    pass_spp = max(1, initial_spp)
+    remaining = spp
+    while remaining > 0:
+        passes.append(min(pass_spp, remaining))
+        remaining -= passes[-1]
+        pass_spp *= max(1, growth)
+    return passes
+
+class FilmAccumulator:
+    '''
+    Accumulate the developed films of successive sample passes into a
+    running average, weighted by the sample count of each pass.
+    '''
+    def __init__(self):
+        self.spp = 0
+        self.image = None
+        self.last_bitmap = None # Developed film of the first pass, as long as it is the only one
+        self.pixel_format = None
+        self.channel_names = None
+
+    def add(self, bitmap, spp):
+        '''
+        Add the developed film of a pass rendered with the given sample count
+        '''
+        if self.spp == 0:
+            # No need to copy anything for the first pass
+            from mitsuba import Struct
+            if bitmap.component_format() != Struct.Type.Float32:
+                bitmap = bitmap.convert(bitmap.pixel_format(), Struct.Type.Float32, False)
+            self.last_bitmap = bitmap
+            self.pixel_format = bitmap.pixel_format()
+            self.channel_names = [field.name for field in bitmap.struct_()]
+        else:
+            if self.image is None:
+                self.image = np.array(self.pixels(), copy=True)
+                self.last_bitmap = None
+            weight = spp / (self.spp + spp)
+            self.image += weight * (np.asarray(bitmap, dtype=np.float32).reshape(self.image.shape) - self.image)
+        self.spp += spp
+
+    def load(self, pixels, spp, channel_names):
+        '''
+        Start from a previously accumulated film of shape (height, width, channels)
+        '''
+        from mitsuba import Bitmap
+        self.image = np.array(pixels, dtype=np.float32, copy=True)
+        self.last_bitmap = None
+        self.spp = spp
+        self.pixel_format = Bitmap.PixelFormat.MultiChannel
+        self.channel_names = list(channel_names)
+
+    def pixels(self):
+        '''
+        Return the accumulated film as a float32 array of shape
+        (height, width, channels), without copying it
+        '''
+        if self.image is None:
+            pixels = np.asarray(self.last_bitmap)
+            return pixels.reshape(pixels.shape[0], pixels.shape[1], -1)
+        return self.image
+
+    def bitmap(self):
+        '''
+        Return the accumulated film as a Mitsuba bitmap
+        '''
+        if self.image is None:
+            return self.last_bitmap
+        from mitsuba import Bitmap
+        return Bitmap(self.image, self.pixel_format, self.channel_names)
@@ -302,6 +302,157 @@ class MitsubaRenderSettings(PropertyGroup):
     bpy.utils.register_class(IntegratorProperties)
     available_integrators : PointerProperty(type = IntegratorProperties)
 
+    use_progressive : BoolProperty(
+        name = "Progressive Render",
+        description = "Render in sample passes of increasing size and display the intermediate results",
+        default = False
+    )
+
+    progressive_initial_spp : IntProperty(
+        name = "Initial Samples",
+        description = "Sample count of the first pass",
+        default = 1,
+        min = 1
+    )
+
+    progressive_growth : IntProperty(
+        name = "Growth Factor",
+        description = "Ratio between the sample counts of two consecutive passes",
+        default = 4,
+        min = 1
+    )
+
+    use_adaptive : BoolProperty(
+        name = "Adaptive Sampling",
+        description = "Render in batches of samples until a time budget is spent or a noise level is reached. The sample count of the sampler is used as a maximum",
+        default = False
+    )
+
+    adaptive_time_budget : FloatProperty(
+        name = "Time Budget",
+        description = "Maximum render time, 0 for no limit",
+        default = 0.0,
+        min = 0.0,
+        subtype = 'TIME_ABSOLUTE',
+        unit = 'TIME_ABSOLUTE'
+    )
+
+    adaptive_noise_threshold : FloatProperty(
+        name = "Noise Threshold",
+        description = "Stop once the estimated mean relative error of the pixels is below this value, 0 to disable",
+        default = 0.01,
+        min = 0.0,
+        soft_max = 0.2,
+        precision = 3
+    )
+
+    adaptive_batch_spp : IntProperty(
+        name = "Batch Samples",
+        description = "Sample count of each batch. The noise level is estimated from at least two batches",
+        default = 4,
+        min = 1
+    )
+
+    viewport_samples : IntProperty(
+        name = "Viewport Samples",
+        description = "Number of samples to render in the viewport, one sample per redraw",
+        default = 16,
+        min = 1
+    )
+
+    use_checkpoints : BoolProperty(
+        name = "Checkpoints",
+        description = "Save the accumulated film after each render, so that more samples can be added to it later",
+        default = False
+    )
+
+    checkpoint_resume : BoolProperty(
+        name = "Resume",
+        description = "Start from the checkpoint of the same scene, if any, and only render the missing samples. Raise the sample count to add samples",
+        default = False
+    )
+
+    checkpoint_dir : StringProperty(
+        name = "Checkpoint Directory",
+        description = "Directory where checkpoints are saved",
+        default = "//checkpoints/",
+        subtype = 'DIR_PATH'
+    )
+
+    use_direct_output : BoolProperty(
+        name = "Direct EXR Output",
+        description = "Write the film, with all its channels, to a multilayer EXR file next to the output path of each frame, with a '_mitsuba' suffix. Files are written in the background while the next frame renders, and only the main pass goes through Blender's render result",
+        default = False
+    )
+
+    direct_output_half : BoolProperty(
+        name = "Half Float",
+        description = "Store the channels of the EXR files as 16-bit floats",
+        default = False
+    )
+
+    use_result_cache : BoolProperty(
+        name = "Result Cache",
+        description = "Reuse the render result of identical scenes. Results are saved as EXR files in the cache directory",
+        default = False
+    )
+
+    result_cache_dir : StringProperty(
+        name = "Result Cache Directory",
+        description = "Directory where render results are cached",
+        default = "//cache/results/",
+        subtype = 'DIR_PATH'
+    )
+
+    result_cache_size : FloatProperty(
+        name = "Cache Size",
+        description = "Maximum size of the result cache, in GB. The least recently used results are removed first",
+        default = 10.0,
+        min = 0.0
+    )
+
+    use_auto_instancing : BoolProperty(
+        name = "Automatic Instancing",
+        description = "Render objects sharing the same mesh, or identical meshes, as instances of a single shape, which saves memory and scene loading time",
+        default = False
+    )
+
+    worker_count : IntProperty(
+        name = "Processes",
+        description = "Number of worker processes rendering the frame at once, each with a subset of the samples and of the render threads",
+        default = 1,
+        min = 1,
+        soft_max = 16
+    )
+
+    use_bands : BoolProperty(
+        name = "Render in Bands",
+        description = "Render the image in horizontal bands, one after the other, so that only the film of one band is kept in memory. Useful for very large resolutions",
+        default = False
+    )
+
+    band_height : IntProperty(
+        name = "Band Height",
+        description = "Height of the bands, in pixels",
+        default = 256,
+        min = 1,
+        subtype = 'PIXEL'
+    )
+
+    use_worker : BoolProperty(
+        name = "Separate Process",
+        description = "Render in a separate process, which keeps Mitsuba loaded between renders. Blender is not affected if it crashes",
+        default = False
+    )
+
+    viewport_downscale : IntProperty(
+        name = "Pixel Size",
+        description = "Render the viewport at a lower resolution, for faster updates",
+        default = 2,
+        min = 1,
+        max = 8
+    )
+
     @classmethod
     def register(cls):
         bpy.types.Scene.mitsuba = PointerProperty(
@@ -392,6 +543,155 @@ class MITSUBA_RENDER_PT_integrator(bpy.types.Panel):
         layout.prop(mts_settings, "active_integrator", text="Integrator")
         getattr(mts_settings.available_integrators, mts_settings.active_integrator).draw(layout)
 
+class MITSUBA_RENDER_PT_progressive(bpy.types.Panel):
+    bl_idname = "MITSUBA_RENDER_PT_progressive"
+    bl_label = "Progressive Render"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'render'
+    COMPAT_ENGINES = {'MITSUBA'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.engine in cls.COMPAT_ENGINES
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.mitsuba, "use_progressive", text="")
+
+    def draw(self, context):
+        layout = self.layout
+        mts_settings = context.scene.mitsuba
+        layout.active = mts_settings.use_progressive
+        layout.prop(mts_settings, "progressive_initial_spp")
+        layout.prop(mts_settings, "progressive_growth")
+
+class MITSUBA_RENDER_PT_adaptive(bpy.types.Panel):
+    bl_idname = "MITSUBA_RENDER_PT_adaptive"
+    bl_label = "Adaptive Sampling"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'render'
+    COMPAT_ENGINES = {'MITSUBA'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.engine in cls.COMPAT_ENGINES
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.mitsuba, "use_adaptive", text="")
+
+    def draw(self, context):
+        layout = self.layout
+        mts_settings = context.scene.mitsuba
+        layout.active = mts_settings.use_adaptive
+        layout.prop(mts_settings, "adaptive_time_budget")
+        layout.prop(mts_settings, "adaptive_noise_threshold")
+        layout.prop(mts_settings, "adaptive_batch_spp")
+
+class MITSUBA_RENDER_PT_checkpoints(bpy.types.Panel):
+    bl_idname = "MITSUBA_RENDER_PT_checkpoints"
+    bl_label = "Checkpoints"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'render'
+    bl_options = {'DEFAULT_CLOSED'}
+    COMPAT_ENGINES = {'MITSUBA'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.engine in cls.COMPAT_ENGINES
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.mitsuba, "use_checkpoints", text="")
+
+    def draw(self, context):
+        layout = self.layout
+        mts_settings = context.scene.mitsuba
+        layout.active = mts_settings.use_checkpoints
+        layout.prop(mts_settings, "checkpoint_dir", text="")
+        layout.prop(mts_settings, "checkpoint_resume")
+
+class MITSUBA_OUTPUT_PT_direct_output(bpy.types.Panel):
+    bl_idname = "MITSUBA_OUTPUT_PT_direct_output"
+    bl_label = "Direct EXR Output"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'output'
+    bl_options = {'DEFAULT_CLOSED'}
+    COMPAT_ENGINES = {'MITSUBA'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.engine in cls.COMPAT_ENGINES
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.mitsuba, "use_direct_output", text="")
+
+    def draw(self, context):
+        layout = self.layout
+        mts_settings = context.scene.mitsuba
+        layout.active = mts_settings.use_direct_output
+        layout.prop(mts_settings, "direct_output_half")
+
+class MITSUBA_RENDER_PT_viewport(bpy.types.Panel):
+    bl_idname = "MITSUBA_RENDER_PT_viewport"
+    bl_label = "Viewport"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'render'
+    COMPAT_ENGINES = {'MITSUBA'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.engine in cls.COMPAT_ENGINES
+
+    def draw(self, context):
+        layout = self.layout
+        mts_settings = context.scene.mitsuba
+        layout.prop(mts_settings, "viewport_samples", text="Samples")
+        layout.prop(mts_settings, "viewport_downscale")
+
+class MITSUBA_RENDER_PT_performance(bpy.types.Panel):
+    bl_idname = "MITSUBA_RENDER_PT_performance"
+    bl_label = "Performance"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'render'
+    bl_options = {'DEFAULT_CLOSED'}
+    COMPAT_ENGINES = {'MITSUBA'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.engine in cls.COMPAT_ENGINES
+
+    def draw(self, context):
+        layout = self.layout
+        render = context.scene.render
+        col = layout.column(align=True)
+        col.prop(render, "threads_mode")
+        sub = col.column(align=True)
+        sub.enabled = render.threads_mode == 'FIXED'
+        sub.prop(render, "threads")
+        layout.prop(render, "use_persistent_data", text="Persistent Data")
+        mts_settings = context.scene.mitsuba
+        layout.prop(mts_settings, "use_auto_instancing")
+        row = layout.row()
+        row.prop(mts_settings, "use_worker")
+        sub = row.row()
+        sub.active = mts_settings.use_worker
+        sub.prop(mts_settings, "worker_count")
+        row = layout.row()
+        row.prop(mts_settings, "use_bands")
+        sub = row.row()
+        sub.active = mts_settings.use_bands
+        sub.prop(mts_settings, "band_height", text="Height")
+        col = layout.column()
+        col.prop(mts_settings, "use_result_cache")
+        sub = col.column()
+        sub.active = mts_settings.use_result_cache
+        sub.prop(mts_settings, "result_cache_dir", text="")
+        sub.prop(mts_settings, "result_cache_size")
+
 class MITSUBA_CAMERA_PT_sampler(bpy.types.Panel):
     bl_idname = "MITSUBA_CAMERA_PT_sampler"
     bl_label = "Sampler"
@@ -435,6 +735,12 @@ def register():
     bpy.utils.register_class(MitsubaRenderSettings)
     bpy.utils.register_class(MitsubaCameraSettings)
     bpy.utils.register_class(MITSUBA_RENDER_PT_integrator)
+    bpy.utils.register_class(MITSUBA_RENDER_PT_progressive)
+    bpy.utils.register_class(MITSUBA_RENDER_PT_adaptive)
+    bpy.utils.register_class(MITSUBA_RENDER_PT_checkpoints)
+    bpy.utils.register_class(MITSUBA_OUTPUT_PT_direct_output)
+    bpy.utils.register_class(MITSUBA_RENDER_PT_viewport)
+    bpy.utils.register_class(MITSUBA_RENDER_PT_performance)
     bpy.utils.register_class(MITSUBA_CAMERA_PT_sampler)
     bpy.utils.register_class(MITSUBA_CAMERA_PT_rfilter)
 
@@ -443,5 +749,11 @@ def unregister():
     bpy.utils.unregister_class(MitsubaRenderSettings)
     bpy.utils.unregister_class(MitsubaCameraSettings)
     bpy.utils.unregister_class(MITSUBA_RENDER_PT_integrator)
+    bpy.utils.unregister_class(MITSUBA_RENDER_PT_progressive)
+    bpy.utils.unregister_class(MITSUBA_RENDER_PT_adaptive)
+    bpy.utils.unregister_class(MITSUBA_RENDER_PT_checkpoints)
+    bpy.utils.unregister_class(MITSUBA_OUTPUT_PT_direct_output)
+    bpy.utils.unregister_class(MITSUBA_RENDER_PT_viewport)
+    bpy.utils.unregister_class(MITSUBA_RENDER_PT_performance)
     bpy.utils.unregister_class(MITSUBA_CAMERA_PT_sampler)
     bpy.utils.unregister_class(MITSUBA_CAMERA_PT_rfilter)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+
+def format_duration(seconds):
+    '''
+    Format a duration the way Blender's stats line does, e.g. 1:02.50 or 3.20s
+    '''
+    minutes, seconds = divmod(seconds, 60.0)
+    if minutes >= 1:
+        return f'{int(minutes)}:{seconds:05.2f}'
+    return f'{seconds:.2f}s'
+
+class PhaseTimer:
+    '''
+    Accumulate the wall-clock time spent in each phase of a render.
+    Phases are reported in the order they were first entered.
+    '''
+    def __init__(self):
+        self.durations = {} # Phase name -> time spent in seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        '''
+        Record time spent in a phase that was timed elsewhere, e.g. in the render worker
+        '''
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def get(self, name):
+        return self.durations.get(name, 0.0)
+
+    def total(self):
+        return sum(self.durations.values())
+
+    def summary(self):
+        '''
+        Return a one-line breakdown of the time spent in each phase
+        '''
+        return ' | '.join(f'{name} {format_duration(duration)}' for name, duration in self.durations.items())
+
+# Samples rendered and time spent by the last render with each variant, to compare their throughputs
+variant_rates = {}
+
+def record_variant_rate(variant, samples, seconds):
+    if seconds > 0:
+        variant_rates[variant] = (samples, seconds)
+
+def variant_rates_summary(current_variant):
+    '''
+    Return the throughput of the last render with each variant, starting with the current one
+    '''
+    variants = sorted(variant_rates, key=lambda variant: variant != current_variant)
+    return ' | '.join(f'{variant} {format_rate(*variant_rates[variant])}' for variant in variants)
+
+def format_rate(count, seconds):
+    '''
+    Format a throughput in a human readable way, e.g. 12.3M/s
+    '''
+    rate = count / seconds if seconds > 0 else 0.0
+    for suffix, scale in (('G', 1e9), ('M', 1e6), ('K', 1e3)):
+        if rate >= scale:
+            return f'{rate / scale:.1f}{suffix}/s'
+    return f'{rate:.1f}/s'
@@ -0,0 +1,338 @@
+import bpy
+import os
+import tempfile
+import threading
+import numpy as np
+from math import atan, degrees, pi
+from mathutils import Matrix
+
+from ..io.exporter import SceneConverter
+from ..io.exporter.lights import light_converters
+from ..io.exporter.materials import b_material_to_dict
+from .progressive import FilmAccumulator
+
+def view_sensor_dict(context, width, height, export_ctx):
+    '''
+    Create a Mitsuba sensor matching the point of view of a 3D viewport
+
+    Params
+    ------
+
+    context: Blender context of the 3D viewport
+    width, height: Resolution of the film
+    export_ctx: The export context, used for the coordinate change
+    '''
+    region_data = context.region_data
+    window_matrix = region_data.window_matrix
+    init_rot = Matrix.Rotation(pi, 4, 'Y')
+    to_world = region_data.view_matrix.inverted() @ init_rot
+
+    if region_data.is_perspective:
+        params = {
+            'type': 'perspective',
+            'fov_axis': 'x',
+            'fov': degrees(2.0 * atan(1.0 / window_matrix[0][0])),
+            # Offset of the projection center, e.g. for camera shifts
+            'principal_point_offset_x': window_matrix[0][2] / 2.0,
+            'principal_point_offset_y': -window_matrix[1][2] / 2.0,
+            'near_clip': context.space_data.clip_start,
+            'far_clip': context.space_data.clip_end,
+        }
+    else:
+        params = {
+            'type': 'orthographic',
+        }
+        # Mitsuba's orthographic camera spans [-1, 1] horizontally
+        scale = 1.0 / window_matrix[0][0]
+        to_world = to_world @ Matrix.Diagonal((scale, scale, 1.0, 1.0))
+
+    params['to_world'] = export_ctx.transform_matrix(to_world)
+    params['sampler'] = {
+        'type': 'independent',
+        'sample_count': 1
+    }
+    params['film'] = {
+        'type': 'hdrfilm',
+        'width': width,
+        'height': height,
+        'rfilter': {'type': 'box'}
+    }
+    return params
+
+def scene_object_names(depsgraph):
+    '''
+    Return the names of all the objects of the depsgraph that can be exported
+    '''
+    return {obj.name_full for obj in depsgraph.objects if obj.type in {'MESH', 'FONT', 'SURFACE', 'META', 'LIGHT'}}
+
+class ViewportScene:
+    '''
+    Mitsuba scene kept alive for interactive viewport rendering.
+    Changes of the Blender scene are applied to the loaded scene through its
+    parameters whenever possible, rather than exporting and loading it again.
+    Sample passes are rendered on a background thread, which is stopped
+    before the scene or the view is changed.
+    '''
+    def __init__(self, depsgraph):
+        from mitsuba import Thread
+        # Textures still need to be written to disk, and can be updated by material edits
+        self.texture_dir = tempfile.TemporaryDirectory()
+        Thread.thread().file_resolver().prepend(self.texture_dir.name)
+        self.sensor = None
+        self.view = None
+        self.accumulator = FilmAccumulator()
+        # Render thread
+        self.thread = None
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.pixels = None # Latest accumulated image
+        self.pixels_version = 0 # Incremented with each new image
+        self.error = None # Error raised by the render thread
+        self.load(depsgraph)
+
+    def load(self, depsgraph):
+        '''
+        Export the whole scene and load it
+        '''
+        from mitsuba import traverse, variant
+        self.stop()
+        converter = SceneConverter(render=True)
+        converter.switch_to_object_mode = False
+        # Scene parameters are looked up by ID
+        converter.export_ctx.export_ids = True
+        converter.set_path(os.path.join(self.texture_dir.name, 'scene.xml'))
+        converter.scene_to_dict(depsgraph)
+        self.export_ctx = converter.export_ctx
+        self.mts_scene = converter.dict_to_scene()
+        self.params = traverse(self.mts_scene)
+        self.variant = variant()
+        self.object_names = scene_object_names(depsgraph)
+        # Transforms baked in the vertices of the exported meshes
+        self.matrices = {}
+        for obj in depsgraph.objects:
+            if obj.name_full in self.export_ctx.object_shapes:
+                self.matrices[obj.name_full] = self.export_ctx.axis_mat @ obj.matrix_world
+        self.reset()
+
+    def reset(self):
+        '''
+        Discard the accumulated samples
+        '''
+        self.stop()
+        self.accumulator = FilmAccumulator()
+
+    def update(self, depsgraph):
+        '''
+        Apply the changes flagged in the depsgraph to the loaded scene.
+        Returns False if the changes cannot be applied through the scene
+        parameters, in which case the scene should be loaded again.
+        '''
+        from mitsuba import variant
+        if variant() != self.variant or scene_object_names(depsgraph) != self.object_names:
+            return False
+
+        # The scene must not change while it renders
+        self.stop()
+        try:
+            for update in depsgraph.updates:
+                datablock = update.id
+                if isinstance(datablock, bpy.types.Object):
+                    if datablock.type == 'LIGHT':
+                        if (update.is_updated_transform or update.is_updated_geometry) and not self.update_light(datablock):
+                            return False
+                    elif datablock.type == 'CAMERA':
+                        continue # The viewport uses its own point of view
+                    elif update.is_updated_geometry:
+                        return False
+                    elif update.is_updated_transform and not self.update_transform(datablock):
+                        return False
+                elif isinstance(datablock, bpy.types.Light):
+                    for obj in depsgraph.objects:
+                        if obj.type == 'LIGHT' and obj.data.original == datablock.original and not self.update_light(obj):
+                            return False
+                elif isinstance(datablock, bpy.types.Material):
+                    if not self.update_material(datablock):
+                        return False
+                elif isinstance(datablock, bpy.types.World):
+                    return False
+            self.params.update()
+        except (RuntimeError, TypeError, ValueError) as e:
+            self.export_ctx.log(f'Failed to update the viewport scene: {e}. Reloading it.', 'DEBUG')
+            return False
+
+        self.reset()
+        return True
+
+    def copy_plugin_params(self, plugin_id, mts_obj):
+        '''
+        Copy the parameters of a freshly converted plugin to the plugin with
+        the given ID in the loaded scene. Returns False if both plugins do not
+        have the same structure.
+        '''
+        from mitsuba import traverse
+        new_params = traverse(mts_obj)
+        keys = [(key, f'{plugin_id}.{key}') for key in new_params.keys()]
+        if any(scene_key not in self.params for _, scene_key in keys):
+            return False
+        for key, scene_key in keys:
+            self.params[scene_key] = new_params[key]
+        return True
+
+    def update_transform(self, b_object):
+        '''
+        Move the meshes of an object, by transforming their vertices from the
+        previous object transform to the new one
+        '''
+        shape_ids = self.export_ctx.object_shapes.get(b_object.name_full)
+        if shape_ids is None:
+            return False
+        matrix = self.export_ctx.axis_mat @ b_object.matrix_world
+        delta = np.array(matrix @ self.matrices[b_object.name_full].inverted(), dtype=np.float32)
+        normal_delta = np.linalg.inv(delta[:3, :3]).T
+        for shape_id in shape_ids:
+            key = f'{shape_id}.vertex_positions'
+            positions = np.array(self.params[key], dtype=np.float32).reshape(-1, 3)
+            positions = positions @ delta[:3, :3].T + delta[:3, 3]
+            self.params[key] = type(self.params[key])(positions.ravel())
+
+            key = f'{shape_id}.vertex_normals'
+            if key in self.params and len(self.params[key]) > 0:
+                normals = np.array(self.params[key], dtype=np.float32).reshape(-1, 3) @ normal_delta.T
+                normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+                self.params[key] = type(self.params[key])(normals.ravel())
+        self.matrices[b_object.name_full] = matrix
+        return True
+
+    def update_light(self, b_light):
+        '''
+        Convert a light again and copy its parameters to the loaded emitter
+        '''
+        from mitsuba import load_dict
+        converter = light_converters.get(b_light.data.type)
+        if converter is None:
+            return False
+        return self.copy_plugin_params(f'emit-{b_light.name_full}', load_dict(converter(b_light, self.export_ctx)))
+
+    def update_material(self, b_mat):
+        '''
+        Convert a material again and copy its parameters to the loaded BSDF
+        '''
+        from mitsuba import load_dict
+        mat_id = f'mat-{b_mat.name}'
+        if self.export_ctx.exported_mats.has_mat(mat_id):
+            # Emissive materials are attached to each shape
+            return False
+        if self.export_ctx.data_get(mat_id) is None:
+            # The material is not used by the scene
+            return True
+        mat_params = b_material_to_dict(self.export_ctx, b_mat)
+        if isinstance(mat_params, list) or mat_params['type'] == 'area':
+            return False
+        return self.copy_plugin_params(mat_id, load_dict(mat_params))
+
+    def set_view(self, context, width, height):
+        '''
+        Update the sensor to the point of view of the viewport.
+        Accumulated samples are discarded if it changed.
+        '''
+        from mitsuba import load_dict
+        region_data = context.region_data
+        view = (width, height, tuple(map(tuple, region_data.view_matrix)), tuple(map(tuple, region_data.window_matrix)))
+        if view != self.view:
+            self.reset()
+            self.view = view
+            self.sensor = load_dict(view_sensor_dict(context, width, height, self.export_ctx))
+
+    def start(self, thread_env, spp):
+        '''
+        Render sample passes on a background thread, until spp samples are accumulated
+
+        Params
+        ------
+
+        thread_env: Mitsuba thread environment, needed to use Mitsuba on the render thread
+        spp: Sample count of the viewport
+        '''
+        if self.is_rendering() or self.accumulator.spp >= spp:
+            return
+        self.thread = threading.Thread(target=self.run, args=(thread_env, spp), name='Mitsuba viewport render')
+        self.thread.start()
+
+    def run(self, thread_env, spp):
+        from mitsuba import ScopedSetThreadEnvironment
+        try:
+            with ScopedSetThreadEnvironment(thread_env):
+                while not self.stopping and self.accumulator.spp < spp:
+                    pixels = self.render_pass()
+                    if self.stopping:
+                        break # The pass may have been cancelled before its end
+                    with self.lock:
+                        self.pixels = pixels
+                        self.pixels_version += 1
+        except Exception as e:
+            if not self.stopping:
+                self.error = e
+
+    def is_rendering(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def latest_image(self):
+        '''
+        Return the latest accumulated image, as returned by render_pass, and its version
+        '''
+        with self.lock:
+            return self.pixels, self.pixels_version
+
+    def stop(self):
+        '''
+        Stop the render thread, cancelling the pass being rendered
+        '''
+        if self.thread is None:
+            return
+        self.stopping = True
+        self.mts_scene.integrator().cancel()
+        self.thread.join()
+        self.thread = None
+        self.stopping = False
+
+    def render_pass(self, spp=1):
+        '''
+        Render one more sample pass and return the accumulated image, as
+        RGBA float32 pixels ordered from the bottom row to the top one
+        '''
+        from mitsuba import Bitmap, Struct
+        self.mts_scene.integrator().render(self.mts_scene, self.sensor, seed=self.accumulator.spp, spp=spp)
+        self.accumulator.add(self.sensor.film().bitmap(), spp)
+        bitmap = self.accumulator.bitmap().split()[0][1]
+        pixels = np.array(bitmap.convert(Bitmap.PixelFormat.RGBA, Struct.Type.Float32, srgb_gamma=False), copy=False)
+        return np.ascontiguousarray(pixels[::-1])
+
+    def free(self):
+        self.stop()
+        self.mts_scene = None
+        self.params = None
+        self.sensor = None
+        self.accumulator = None
+        self.texture_dir.cleanup()
+
+class ViewportDrawData:
+    '''
+    GPU texture holding the current viewport image
+    '''
+    def __init__(self):
+        self.texture = None
+        self.version = None # Version of the image in the texture
+
+    def update(self, pixels, version=None):
+        import gpu
+        self.version = version
+        height, width, channels = pixels.shape
+        buffer = gpu.types.Buffer('FLOAT', width * height * channels, pixels.ravel())
+        self.texture = gpu.types.GPUTexture((width, height), format='RGBA16F', data=buffer)
+
+    def draw(self, width, height):
+        if self.texture is None:
+            return
+        from gpu_extras.presets import draw_texture_2d
+        # The texture is stretched over the region when rendering at a lower resolution
+        draw_texture_2d(self.texture, (0, 0), width, height)
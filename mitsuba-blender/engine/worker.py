@@ -0,0 +1,457 @@
+'''
+Out-of-process rendering.
+
+The render worker is a long-lived Python process, started with Blender's own
+interpreter, that loads exported XML scenes and renders them. It keeps Mitsuba
+initialized between renders, and a crash of the worker does not take Blender
+down with it. Developed films are streamed back after each sample pass
+through shared memory, and only small control messages go through the
+connection.
+
+Requests sent to the worker are dicts with a 'cmd' key:
+    render: Render the scene in 'xml' with 'variant' and 'threads'. Sample
+            passes follow the optional 'progressive' (initial spp, growth) schedule.
+            An optional 'spp' overrides the sample count of the sensor, and
+            pass i uses the seed 'seed_offset' + i * 'seed_stride', so that
+            several workers can render independent subsets of the samples.
+    ack: The last film was read, the next one can be written.
+    cancel: Stop the current render.
+    quit: Exit the worker.
+Messages sent back are dicts with a 'type' key: loaded, film, done,
+cancelled or error.
+
+Run with '--warm-up VARIANT', the script instead renders a tiny scene and
+exits, so that the kernels of a JIT variant are compiled and saved in Dr.Jit's
+kernel cache before the first render.
+'''
+import os
+import sys
+import threading
+import time
+import traceback
+import subprocess
+import numpy as np
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+if __package__:
+    from .progressive import sample_pass_schedule, FilmAccumulator
+else:
+    # Run as a script in the worker process
+    from progressive import sample_pass_schedule, FilmAccumulator
+
+AUTHKEY_ENV = 'MITSUBA_BLENDER_WORKER_AUTHKEY'
+
+# Delay between two checks for a cancellation while a pass is rendering, in seconds
+POLL_INTERVAL = 0.1
+# Delay after which a worker that doesn't acknowledge a cancellation is killed, in seconds
+CANCEL_TIMEOUT = 10.0
+
+class WorkerCancelled(Exception):
+    pass
+
+# Directory of Dr.Jit's kernel cache in the worker processes, None for the default one
+_kernel_cache_dir = None
+
+def set_kernel_cache_dir(path):
+    '''
+    Set the directory of Dr.Jit's kernel cache in the worker and warm-up
+    processes started from now on, None for the default one.
+    Dr.Jit has no setting for it: the cache is the '.drjit' folder of the home
+    directory, or the 'drjit' folder of the temporary directory on Windows, so
+    the worker processes get the given directory as their home or temporary
+    directory. Changing them in Blender's own process would affect everything
+    else running in it, so it always uses the default cache.
+    '''
+    global _kernel_cache_dir
+    _kernel_cache_dir = path
+
+def worker_environment():
+    '''
+    Environment of the worker processes
+    '''
+    env = dict(os.environ)
+    # The worker needs to find Mitsuba the same way the add-on did
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+    env['DRJIT_NO_RTLD_DEEPBIND'] = 'True'
+    if _kernel_cache_dir:
+        os.makedirs(_kernel_cache_dir, exist_ok=True)
+        if os.name == 'nt':
+            env['TMP'] = env['TEMP'] = _kernel_cache_dir
+        else:
+            env['HOME'] = _kernel_cache_dir
+    return env
+
+class RenderWorker:
+    '''
+    Handle to a render worker process, used from Blender
+    '''
+    def __init__(self):
+        authkey = os.urandom(16)
+        env = worker_environment()
+        env[AUTHKEY_ENV] = authkey.hex()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdout=subprocess.PIPE, env=env)
+        # The worker prints the address it listens to once it is ready
+        address = self.process.stdout.readline().decode().strip()
+        # Nothing else is read from the pipe, the worker writes its output to stderr afterwards
+        self.process.stdout.close()
+        if not address:
+            raise RuntimeError('The Mitsuba render worker failed to start.')
+        host, port = address.rsplit(':', 1)
+        self.conn = Client((host, int(port)), authkey=authkey)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def render(self, request, test_break, callback):
+        '''
+        Render a scene in the worker
+
+        Params
+        ------
+
+        request: The render request, see the module documentation
+        test_break: Function returning True if the render should be cancelled
+        callback: Function called with each message of the worker and, for
+                  films, a (height, width, channels) view of the shared film.
+                  The view is only valid during the call.
+
+        Returns False if the render was cancelled.
+        '''
+        self.conn.send(request)
+        cancelled = False
+        cancel_time = None
+        shm = None
+        try:
+            while True:
+                if not self.conn.poll(POLL_INTERVAL):
+                    if not cancelled and test_break():
+                        self.conn.send({'cmd': 'cancel'})
+                        cancelled = True
+                    if cancelled:
+                        cancel_time = cancel_time or time.perf_counter()
+                        if time.perf_counter() - cancel_time > CANCEL_TIMEOUT:
+                            # The worker is stuck, it is started again by the next render
+                            self.process.kill()
+                            self.process.wait()
+                            self.conn.close()
+                            return False
+                    continue
+                message = self.conn.recv()
+                if message['type'] == 'error':
+                    raise RuntimeError(f"Mitsuba render worker: {message['message']}")
+                if message['type'] in {'done', 'cancelled'}:
+                    return message['type'] == 'done'
+                if message['type'] == 'film':
+                    if shm is None or shm.name != message['shm']:
+                        shm = attach_shared_memory(message['shm'])
+                    pixels = np.ndarray(message['shape'], dtype=np.float32, buffer=shm.buf)
+                    callback(message, pixels)
+                    # Release the view, so that the shared memory can be closed
+                    del pixels
+                    if not cancelled and test_break():
+                        self.conn.send({'cmd': 'cancel'})
+                        cancelled = True
+                    else:
+                        self.conn.send({'cmd': 'ack'})
+                else:
+                    callback(message, None)
+        except (EOFError, ConnectionError) as e:
+            raise RuntimeError('The Mitsuba render worker stopped unexpectedly.') from e
+        finally:
+            if shm is not None:
+                shm.close()
+
+    def close(self):
+        if self.alive():
+            try:
+                self.conn.send({'cmd': 'quit'})
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.conn.close()
+
+def attach_shared_memory(name):
+    '''
+    Open a shared memory block created by the worker, which remains its owner
+    '''
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        # Attached blocks are registered for cleanup at exit, which would
+        # unlink them a second time (fixed by track=False in Python 3.13)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+_workers = []
+
+def get_workers(count):
+    '''
+    Return a pool of render workers, starting them if needed
+    '''
+    for index in range(count):
+        if index == len(_workers):
+            _workers.append(RenderWorker())
+        elif not _workers[index].alive():
+            _workers[index] = RenderWorker()
+    return _workers[:count]
+
+def get_worker():
+    '''
+    Return the render worker, starting it if needed
+    '''
+    return get_workers(1)[0]
+
+def shutdown_worker():
+    while _workers:
+        _workers.pop().close()
+
+def split_samples(spp, count):
+    '''
+    Split a sample count into at most count subsets of nearly equal size
+    '''
+    return [spp // count + (1 if index < spp % count else 0) for index in range(min(count, spp))]
+
+def render_distributed(workers, requests, test_break, callback):
+    '''
+    Render independent subsets of the samples of a scene in several workers at
+    once, and merge their films into their average weighted by sample count.
+
+    Params
+    ------
+
+    workers: The render workers, one per request
+    requests: The render requests, whose seeds must not overlap
+    test_break: Function returning True if the render should be cancelled
+    callback: Function called on the calling thread with the 'loaded' message
+              of the first worker, the merged film of shape (height, width,
+              channels) and its sample count, whenever a worker sends a film.
+              The merged film is only valid during the call.
+
+    Returns False if the render was cancelled.
+    '''
+    lock = threading.Lock()
+    updated = threading.Event()
+    stop = threading.Event()
+    films = [None] * len(workers) # (pixels, spp) of each worker
+    state = {'loaded': None, 'channels': None}
+    results = [None] * len(workers)
+    errors = []
+
+    def on_message(index, message, pixels):
+        with lock:
+            if message['type'] == 'loaded':
+                if state['loaded'] is None:
+                    state['loaded'] = message
+            elif message['type'] == 'film':
+                # The shared film is overwritten by the next pass of the worker
+                films[index] = (np.array(pixels, copy=True), message['spp'])
+                state['channels'] = message['channels']
+        updated.set()
+
+    def run(index):
+        try:
+            results[index] = workers[index].render(requests[index], stop.is_set,
+                                                   lambda message, pixels: on_message(index, message, pixels))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        updated.set()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(workers))]
+    for thread in threads:
+        thread.start()
+
+    merged = None
+    while any(thread.is_alive() for thread in threads) or updated.is_set():
+        if updated.wait(POLL_INTERVAL):
+            updated.clear()
+            with lock:
+                available = [film for film in films if film is not None]
+                if available:
+                    spp = sum(film_spp for _, film_spp in available)
+                    if merged is None or merged.shape != available[0][0].shape:
+                        merged = np.empty_like(available[0][0])
+                    merged[...] = 0.0
+                    for pixels, film_spp in available:
+                        merged += (film_spp / spp) * pixels
+                    loaded = dict(state['loaded'], channels=state['channels'])
+            if available:
+                callback(loaded, merged, spp)
+        # Checked on every iteration, workers may send films faster than the poll interval
+        if not stop.is_set() and test_break():
+            stop.set()
+
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0] if isinstance(errors[0], RuntimeError) else RuntimeError(str(errors[0]))
+    return all(results) and not stop.is_set()
+
+_warm_up_process = None
+
+def start_warm_up(variant):
+    '''
+    Compile the kernels of a JIT variant in the background, by rendering a tiny
+    scene in a separate process. Kernels are shared through Dr.Jit's on-disk
+    cache, so Blender's first render with this variant skips most of the compilation.
+    With a custom kernel cache directory, only the render workers share it.
+    '''
+    global _warm_up_process
+    if _warm_up_process is not None and _warm_up_process.poll() is None:
+        return
+    _warm_up_process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--warm-up', variant],
+                                        env=worker_environment(), stdout=subprocess.DEVNULL)
+
+# Worker process
+
+def render_pass(conn, thread_env, mts_scene, sensor, seed, spp):
+    '''
+    Render one sample pass, while listening for cancellation requests
+    '''
+    import mitsuba as mi
+    integrator = mts_scene.integrator()
+    errors = []
+
+    def run():
+        try:
+            with mi.ScopedSetThreadEnvironment(thread_env):
+                integrator.render(mts_scene, sensor, seed=seed, spp=spp)
+        except Exception as e:
+            errors.append(e)
+
+    render_thread = threading.Thread(target=run)
+    render_thread.start()
+    cancelled = False
+    while render_thread.is_alive():
+        render_thread.join(POLL_INTERVAL)
+        if not cancelled and conn.poll():
+            if conn.recv()['cmd'] in {'cancel', 'quit'}:
+                integrator.cancel()
+                cancelled = True
+
+    if errors:
+        raise errors[0]
+    if cancelled:
+        raise WorkerCancelled()
+
+def render_request(conn, thread_env, request):
+    import mitsuba as mi
+    import drjit as dr
+    mi.set_variant(request['variant'])
+    if request.get('threads') and dr.thread_count() != request['threads']:
+        dr.set_thread_count(request['threads'])
+
+    start = time.perf_counter()
+    mts_scene = mi.load_file(request['xml'])
+    sensor = mts_scene.sensors()[0]
+    film = sensor.film()
+    spp = request.get('spp') or sensor.sampler().sample_count()
+    conn.send({
+        'type': 'loaded',
+        'time': time.perf_counter() - start,
+        'spp': spp,
+        'crop_offset': tuple(film.crop_offset()),
+        'crop_size': tuple(film.crop_size()),
+    })
+
+    progressive = request.get('progressive')
+    passes = sample_pass_schedule(spp, *progressive) if progressive else [spp]
+    accumulator = FilmAccumulator()
+    shm = None
+    try:
+        for pass_index, pass_spp in enumerate(passes):
+            start = time.perf_counter()
+            seed = request.get('seed_offset', 0) + pass_index * request.get('seed_stride', 1)
+            render_pass(conn, thread_env, mts_scene, sensor, seed, pass_spp)
+            render_time = time.perf_counter() - start
+            accumulator.add(film.bitmap(), pass_spp)
+            pixels = accumulator.pixels()
+            if shm is None:
+                shm = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+            np.ndarray(pixels.shape, dtype=np.float32, buffer=shm.buf)[...] = pixels
+            conn.send({
+                'type': 'film',
+                'shm': shm.name,
+                'shape': pixels.shape,
+                'channels': accumulator.channel_names,
+                'spp': accumulator.spp,
+                'time': render_time,
+            })
+            # Don't overwrite the film until Blender has read it
+            if conn.recv()['cmd'] != 'ack':
+                raise WorkerCancelled()
+        conn.send({'type': 'done'})
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+def serve(conn):
+    import mitsuba as mi
+    mi.set_variant('scalar_rgb')
+    thread_env = mi.ThreadEnvironment()
+    while True:
+        request = conn.recv()
+        if request['cmd'] == 'quit':
+            return
+        if request['cmd'] != 'render':
+            continue # Late acknowledgment or cancellation
+        try:
+            with mi.ScopedSetThreadEnvironment(thread_env):
+                render_request(conn, thread_env, request)
+        except WorkerCancelled:
+            conn.send({'type': 'cancelled'})
+        except Exception:
+            conn.send({'type': 'error', 'message': traceback.format_exc()})
+
+def warm_up(variant):
+    import mitsuba as mi
+    mi.set_variant(variant)
+    # Common plugins of exported scenes
+    mts_scene = mi.load_dict({
+        'type': 'scene',
+        'integrator': {'type': 'path'},
+        'sensor': {
+            'type': 'perspective',
+            'film': {'type': 'hdrfilm', 'width': 16, 'height': 16},
+            'sampler': {'type': 'independent', 'sample_count': 4},
+        },
+        'environment': {'type': 'constant'},
+        'light': {
+            'type': 'rectangle',
+            'to_world': mi.ScalarTransform4f.translate([0, 2, 5]),
+            'emitter': {'type': 'area'},
+        },
+        'object': {
+            'type': 'sphere',
+            'center': [0, 0, 5],
+            'bsdf': {'type': 'principled'},
+        },
+        'floor': {
+            'type': 'rectangle',
+            'to_world': mi.ScalarTransform4f.translate([0, -1, 5]).scale(4),
+            'bsdf': {'type': 'diffuse', 'reflectance': {'type': 'checkerboard'}},
+        },
+    })
+    mi.render(mts_scene)
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--warm-up':
+        warm_up(sys.argv[2])
+        return
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    with Listener(('localhost', 0), authkey=authkey) as listener:
+        host, port = listener.address
+        print(f'{host}:{port}', flush=True)
+        # Blender stops reading stdout after the address, Mitsuba's log output would
+        # eventually fill the pipe and block the worker
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        with listener.accept() as conn:
+            try:
+                serve(conn)
+            except (EOFError, ConnectionError):
+                pass # Blender exited
+
+if __name__ == '__main__':
+    main()
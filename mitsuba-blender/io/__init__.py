@@ -6,7 +6,11 @@ if "bpy" in locals():
         importlib.reload(importer)
     if "exporter" in locals():
         importlib.reload(exporter)
+    if "incremental" in locals():
+        importlib.reload(incremental)
 
+import os
+import tempfile
 import bpy
 from bpy.props import (
         StringProperty,
@@ -22,6 +26,7 @@ from bpy_extras.io_utils import (
 from . import bl_utils
 from . import importer
 from . import exporter
+from .exporter import incremental
 
 @orientation_helper(axis_forward='-Z', axis_up='Y')
 class ImportMistuba(bpy.types.Operator, ImportHelper):
@@ -98,6 +103,24 @@ class ExportMitsuba(bpy.types.Operator, ExportHelper):
             default = False
     )
 
+    auto_instancing: BoolProperty(
+            name = "Automatic Instancing",
+            description = "Export objects sharing the same mesh, or identical meshes, as instances of a single shape group",
+            default = False
+    )
+
+    use_mesh_cache: BoolProperty(
+            name = "Mesh Cache",
+            description = "Link the meshes that did not change since a previous export from the mesh cache, rather than writing them again. The cache is set up in the add-on preferences",
+            default = False
+    )
+
+    watch: BoolProperty(
+            name = "Watch",
+            description = "Keep the exported scene in sync with the changes made in Blender, until watching is stopped from the export menu. Only the changed objects are exported again",
+            default = False
+    )
+
     ignore_background: BoolProperty(
             name = "Ignore Default Background",
             description = "Ignore blender's default constant gray background when exporting to Mitsuba.",
@@ -123,6 +146,26 @@ class ExportMitsuba(bpy.types.Operator, ExportHelper):
         self.converter.export_ctx.export_ids = self.export_ids
 
         self.converter.use_selection = self.use_selection
+        self.converter.auto_instancing = self.auto_instancing
+
+        if self.use_mesh_cache:
+            prefs = context.preferences.addons[__package__.rpartition('.')[0]].preferences
+            cache_dir = bpy.path.abspath(prefs.mesh_cache_dir) if prefs.mesh_cache_dir else os.path.join(tempfile.gettempdir(), 'mitsuba-blender', 'meshes')
+            self.converter.export_ctx.mesh_cache = exporter.disk_cache.DiskCache(cache_dir, int(prefs.mesh_cache_size * 1024**3), '.ply')
+
+        if self.watch:
+            # The converters of the incremental exports are set up like this one
+            settings = {
+                'axis_mat': axis_mat,
+                'use_selection': self.use_selection,
+                'auto_instancing': self.auto_instancing,
+                'ignore_background': self.ignore_background,
+                'mesh_cache': self.converter.export_ctx.mesh_cache,
+            }
+            incremental.start_watching(context.evaluated_depsgraph_get(), self.filepath, self.split_files, settings)
+            self.report({'INFO'}, "Scene exported successfully! Watching it for changes.")
+            self.reset()
+            return {'FINISHED'}
 
         # Set path to scene .xml file
         self.converter.set_path(self.filepath, split_files=self.split_files)
@@ -148,8 +191,23 @@ class ExportMitsuba(bpy.types.Operator, ExportHelper):
         return {'FINISHED'}
 
 
+class MITSUBA_OT_stop_watching(bpy.types.Operator):
+    """Stop updating the watched Mitsuba export"""
+    bl_idname = "export_scene.mitsuba_stop_watching"
+    bl_label = "Stop Watching Mitsuba Export"
+
+    @classmethod
+    def poll(cls, context):
+        return incremental.watched_filepath() is not None
+
+    def execute(self, context):
+        incremental.stop_watching()
+        return {'FINISHED'}
+
 def menu_export_func(self, context):
     self.layout.operator(ExportMitsuba.bl_idname, text="Mitsuba (.xml)")
+    if incremental.watched_filepath() is not None:
+        self.layout.operator(MITSUBA_OT_stop_watching.bl_idname, text="Stop Watching Mitsuba Export")
 
 def menu_import_func(self, context):
     self.layout.operator(ImportMistuba.bl_idname, text="Mitsuba (.xml)")
@@ -157,7 +215,8 @@ def menu_import_func(self, context):
 
 classes = (
     ImportMistuba,
-    ExportMitsuba
+    ExportMitsuba,
+    MITSUBA_OT_stop_watching
 )
 
 def register():
@@ -168,6 +227,7 @@ def register():
     bpy.types.TOPBAR_MT_file_import.append(menu_import_func)
 
 def unregister():
+    incremental.stop_watching()
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
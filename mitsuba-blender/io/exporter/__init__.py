@@ -1,7 +1,12 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 if "bpy" in locals():
     import importlib
+    if "fingerprint" in locals():
+        importlib.reload(fingerprint)
+    if "disk_cache" in locals():
+        importlib.reload(disk_cache)
     if "export_context" in locals():
         importlib.reload(export_context)
     if "materials" in locals():
@@ -15,12 +20,27 @@ if "bpy" in locals():
 
 import bpy
 
+from . import fingerprint
+from . import disk_cache
 from . import export_context
 from . import materials
 from . import geometry
 from . import lights
 from . import camera
 
+def particle_objects():
+    '''
+    Return the names of the objects instanced by particle systems
+    '''
+    particles = []
+    for particle_sys in bpy.data.particles:
+        if particle_sys.render_type == 'OBJECT':
+            particles.append(particle_sys.instance_object.name)
+        elif particle_sys.render_type == 'COLLECTION':
+            for obj in particle_sys.instance_collection.objects:
+                particles.append(obj.name)
+    return particles
+
 class SceneConverter:
     '''
     Converts a blender scene to a Mitsuba-compatible dict.
@@ -31,27 +51,97 @@ class SceneConverter:
         self.use_selection = False # Only export selection
         self.ignore_background = True
         self.render = render
+        # When rendering inside blender, meshes are directly handed over to Mitsuba
+        self.export_ctx.write_meshes = not render
+        # The viewport cannot change the interaction mode while the user is editing
+        self.switch_to_object_mode = True
+        # Names of the cameras to export. By default, all cameras are exported,
+        # except when rendering inside blender where only the active one is.
+        self.cameras = None
+        # AOVs rendered along with the image, as 'name:type' strings (e.g. 'dd.y:depth')
+        self.aovs = None
+        # Export objects sharing the same mesh as instances of a single shapegroup
+        self.auto_instancing = False
+        # Threads converting meshes and writing files while Blender data is read
+        # on the main thread. Only used when meshes are saved to disk.
+        self.export_threads = os.cpu_count() or 1
 
     def set_path(self, name, split_files=False):
         from mitsuba.python.xml import WriteXML
         # Ideally, this should only be created if we want to write a scene.
         # For now we need it to save meshes and packed textures.
         # TODO: get rid of all writing to disk when creating the dict
-        if not self.render:
+        if self.export_ctx.write_meshes:
             self.xml_writer = WriteXML(name, self.export_ctx.subfolders,
                                        split_files=split_files)
         # Give the path to the export context, for saving meshes and files
         self.export_ctx.directory, _ = os.path.split(name)
 
-    def scene_to_dict(self, depsgraph, window_manager):
+    def scene_to_dict(self, depsgraph, window_manager=None):
+        if not self.export_ctx.write_meshes or self.export_threads <= 1:
+            self.export_scene(depsgraph, window_manager)
+            self.evict_mesh_cache()
+            return
+
+        from mitsuba import ThreadEnvironment
+        # Mesh conversions and file writes are submitted in order to the thread
+        # pool, the scene dict itself is only built on the main thread
+        self.export_ctx.thread_env = ThreadEnvironment()
+        # Enough queued tasks to keep the threads busy, without holding the meshes of the whole scene
+        self.export_ctx.max_pending_tasks = 2 * self.export_threads
+        with ThreadPoolExecutor(self.export_threads, thread_name_prefix='Mitsuba export') as executor:
+            self.export_ctx.executor = executor
+            try:
+                self.export_scene(depsgraph, window_manager)
+                self.export_ctx.wait_tasks()
+            finally:
+                self.export_ctx.executor = None
+                self.export_ctx.pending_tasks = []
+        self.evict_mesh_cache()
+
+    def evict_mesh_cache(self):
+        # Evicted once all the meshes are written, rather than after each one
+        if self.export_ctx.mesh_cache is not None:
+            self.export_ctx.mesh_cache.evict()
+
+    def export_scene(self, depsgraph, window_manager=None):
         # Switch to object mode before exporting stuff, so everything is defined properly
-        if bpy.ops.object.mode_set.poll():
+        if self.switch_to_object_mode and bpy.ops.object.mode_set.poll():
             bpy.ops.object.mode_set(mode='OBJECT')
 
         #depsgraph = context.evaluated_depsgraph_get()
         self.export_ctx.deg = depsgraph
 
         b_scene = depsgraph.scene #TODO: what if there are multiple scenes?
+        self.export_ctx.data_add(self.integrator_dict(b_scene))
+
+        materials.export_world(self.export_ctx, b_scene.world, self.ignore_background)
+
+        particles = particle_objects()
+
+        if self.auto_instancing:
+            # Find the meshes shared between objects before exporting any of them
+            shared_objects = []
+            for object_instance in depsgraph.object_instances:
+                evaluated_obj = object_instance.object
+                if (object_instance.is_instance or evaluated_obj.type != 'MESH' or evaluated_obj.hide_render
+                    or evaluated_obj.name in particles
+                    or (evaluated_obj.parent is not None and evaluated_obj.parent.is_instancer)
+                    or (self.use_selection and not evaluated_obj.original.select_get())):
+                    continue
+                shared_objects.append(evaluated_obj)
+            self.export_ctx.shared_meshes = geometry.find_shared_meshes(shared_objects)
+
+        progress_counter = 0
+        # Main export loop
+        for object_instance in depsgraph.object_instances:
+            if window_manager is not None:
+                window_manager.progress_update(progress_counter)
+            progress_counter += 1
+
+            self.export_instance(object_instance, b_scene, particles)
+
+    def integrator_dict(self, b_scene):
         if b_scene.render.engine == 'MITSUBA':
             integrator = getattr(b_scene.mitsuba.available_integrators,b_scene.mitsuba.active_integrator).to_dict()
         else:
@@ -59,54 +149,65 @@ class SceneConverter:
                 'type':'path',
                 'max_depth': b_scene.cycles.max_bounces
             }
-        self.export_ctx.data_add(integrator)
+        if self.aovs:
+            integrator = {
+                'type': 'aov',
+                'aovs': ','.join(self.aovs),
+                'integrator': integrator
+            }
+        return integrator
 
-        materials.export_world(self.export_ctx, b_scene.world, self.ignore_background)
+    def export_instance(self, object_instance, b_scene, particles):
+        '''
+        Export an object instance of the depsgraph, if it is rendered
 
-        # Establish list of particle objects
-        particles = []
-        for particle_sys in bpy.data.particles:
-            if particle_sys.render_type == 'OBJECT':
-                particles.append(particle_sys.instance_object.name)
-            elif particle_sys.render_type == 'COLLECTION':
-                for obj in particle_sys.instance_collection.objects:
-                    particles.append(obj.name)
+        Params
+        ------
 
-        progress_counter = 0
-        # Main export loop
-        for object_instance in depsgraph.object_instances:
-            window_manager.progress_update(progress_counter)
-            progress_counter += 1
-
-            if self.use_selection:
-                #skip if it's not selected or if it's an instance and the parent object is not selected
-                if not object_instance.is_instance and not object_instance.object.original.select_get():
-                    continue
-                if (object_instance.is_instance and object_instance.object.parent
-                    and not object_instance.object.parent.original.select_get()):
-                    continue
+        object_instance: The depsgraph object instance
+        b_scene: The exported scene
+        particles: Names of the objects instanced by particle systems
+        '''
+        if self.use_selection:
+            #skip if it's not selected or if it's an instance and the parent object is not selected
+            if not object_instance.is_instance and not object_instance.object.original.select_get():
+                return
+            if (object_instance.is_instance and object_instance.object.parent
+                and not object_instance.object.parent.original.select_get()):
+                return
 
-            evaluated_obj = object_instance.object
-            object_type = evaluated_obj.type
-            #type: enum in [‘MESH’, ‘CURVE’, ‘SURFACE’, ‘META’, ‘FONT’, ‘ARMATURE’, ‘LATTICE’, ‘EMPTY’, ‘GPENCIL’, ‘CAMERA’, ‘LIGHT’, ‘SPEAKER’, ‘LIGHT_PROBE’], default ‘EMPTY’, (readonly)
-            if evaluated_obj.hide_render or (object_instance.is_instance
-                and evaluated_obj.parent and evaluated_obj.parent.original.hide_render):
-                self.export_ctx.log("Object: {} is hidden for render. Ignoring it.".format(evaluated_obj.name), 'INFO')
-                continue#ignore it since we don't want it rendered (TODO: hide_viewport)
-            if object_type in {'MESH', 'FONT', 'SURFACE', 'META'}:
-                geometry.export_object(object_instance, self.export_ctx, evaluated_obj.name in particles)
-            elif object_type == 'CAMERA':
-                # When rendering inside blender, export only the active camera
-                if (self.render and evaluated_obj.name_full == b_scene.camera.name_full) or not self.render:
-                    camera.export_camera(object_instance, b_scene, self.export_ctx)
-            elif object_type == 'LIGHT':
-                lights.export_light(object_instance, self.export_ctx)
+        evaluated_obj = object_instance.object
+        object_type = evaluated_obj.type
+        #type: enum in [‘MESH’, ‘CURVE’, ‘SURFACE’, ‘META’, ‘FONT’, ‘ARMATURE’, ‘LATTICE’, ‘EMPTY’, ‘GPENCIL’, ‘CAMERA’, ‘LIGHT’, ‘SPEAKER’, ‘LIGHT_PROBE’], default ‘EMPTY’, (readonly)
+        if evaluated_obj.hide_render or (object_instance.is_instance
+            and evaluated_obj.parent and evaluated_obj.parent.original.hide_render):
+            self.export_ctx.log("Object: {} is hidden for render. Ignoring it.".format(evaluated_obj.name), 'INFO')
+            return#ignore it since we don't want it rendered (TODO: hide_viewport)
+        if object_type in {'MESH', 'FONT', 'SURFACE', 'META'}:
+            geometry.export_object(object_instance, self.export_ctx, evaluated_obj.name in particles)
+        elif object_type == 'CAMERA':
+            if self.cameras is not None:
+                export_camera = evaluated_obj.name_full in self.cameras
             else:
-                self.export_ctx.log("Object: %s of type '%s' is not supported!" % (evaluated_obj.name_full, object_type), 'WARN')
+                # When rendering inside blender, export only the active camera
+                export_camera = not self.render or (b_scene.camera is not None and evaluated_obj.name_full == b_scene.camera.name_full)
+            if export_camera:
+                camera.export_camera(object_instance, b_scene, self.export_ctx, use_border=self.render)
+        elif object_type == 'LIGHT':
+            lights.export_light(object_instance, self.export_ctx)
+        else:
+            self.export_ctx.log("Object: %s of type '%s' is not supported!" % (evaluated_obj.name_full, object_type), 'WARN')
 
     def dict_to_xml(self):
         self.xml_writer.process(self.export_ctx.scene_data)
 
     def dict_to_scene(self):
         from mitsuba import load_dict
+        plugin_cache = self.export_ctx.plugin_cache
+        if plugin_cache is not None:
+            # Reuse the plugins that did not change since the previous export
+            for name, mts_dict in list(self.export_ctx.scene_data.items()):
+                if isinstance(mts_dict, dict) and not fingerprint.has_refs(mts_dict):
+                    self.export_ctx.data_load(name)
+            plugin_cache.prune()
         return load_dict(self.export_ctx.scene_data)
@@ -2,7 +2,18 @@ from mathutils import Matrix
 import numpy as np
 from math import degrees
 
-def export_camera(camera_instance, b_scene, export_ctx):
+def export_camera(camera_instance, b_scene, export_ctx, use_border=False):
+    '''
+    Export a camera as a Mitsuba sensor
+
+    Params
+    ------
+
+    camera_instance: The depsgraph instance of the camera
+    b_scene: The blender scene
+    export_ctx: The export context
+    use_border: Only render the border region of the scene, if it is enabled
+    '''
     #camera
     b_camera = camera_instance.object#TODO: instances here too?
     params = {}
@@ -52,6 +63,19 @@ def export_camera(camera_instance, b_scene, export_ctx):
     film['width'] = int(res_x * scale)
     film['height'] = int(res_y * scale)
 
+    if use_border and b_scene.render.use_border:
+        # Map the border region to the film crop window, truncated like Blender
+        # does, so that it matches the rectangle of the render result
+        min_x = int(b_scene.render.border_min_x * film['width'])
+        max_x = int(b_scene.render.border_max_x * film['width'])
+        min_y = int(b_scene.render.border_min_y * film['height'])
+        max_y = int(b_scene.render.border_max_y * film['height'])
+        film['crop_offset_x'] = min_x
+        # Blender's border starts at the bottom of the frame, Mitsuba's crop window at the top
+        film['crop_offset_y'] = film['height'] - max(max_y, min_y + 1)
+        film['crop_width'] = max(1, max_x - min_x)
+        film['crop_height'] = max(1, max_y - min_y)
+
 
     if b_scene.render.engine == 'MITSUBA':
         film['rfilter'] = getattr(b_camera.data.mitsuba.rfilters, b_camera.data.mitsuba.active_rfilter).to_dict()
@@ -0,0 +1,95 @@
+import os
+import threading
+
+class DiskCache:
+    '''
+    Directory of files addressed by a content key, limited in size.
+    When the cache grows over its maximum size, the least recently used files
+    are removed first. Files are marked as used by updating their modification time.
+
+    Params
+    ------
+
+    directory: Directory holding the cached files
+    max_size: Maximum total size of the cached files, in bytes
+    suffix: Extension of the cached files, e.g. '.exr'
+    '''
+    def __init__(self, directory, max_size, suffix=''):
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}{self.suffix}')
+
+    def get(self, key):
+        '''
+        Return the path of the cached file with the given key, or None if it is not cached
+        '''
+        filepath = self.path(key)
+        try:
+            os.utime(filepath)
+        except FileNotFoundError:
+            return None
+        return filepath
+
+    def put(self, key, write, evict=True):
+        '''
+        Add a file to the cache and return its path
+
+        Params
+        ------
+
+        key: Key of the file
+        write: Function writing the file to the path it is given
+        evict: Evict files right away if the cache is too large. When adding
+               many files, it is cheaper to call evict() once afterwards.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        filepath = self.path(key)
+        # Write to a temporary file first, so that other processes never see a partial file
+        temp_path = os.path.join(self.directory, f'{key}.{os.getpid()}-{threading.get_ident()}.tmp{self.suffix}')
+        try:
+            write(temp_path)
+            os.replace(temp_path, filepath)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if evict:
+            self.evict(keep=filepath)
+        return filepath
+
+    def entries(self):
+        '''
+        Return the cached files, as (path, size, last use time), least recently used first
+        '''
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.suffix) and '.tmp' not in entry.name:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue # Evicted by another process
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self, keep=None):
+        '''
+        Remove the least recently used files until the cache fits in its maximum size
+        '''
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for filepath, size, _ in entries:
+            if total_size <= self.max_size:
+                break
+            if filepath == keep:
+                continue
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass # Evicted by another process
+            total_size -= size
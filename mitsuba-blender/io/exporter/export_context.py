@@ -1,6 +1,7 @@
 from collections import OrderedDict
 import os
 from shutil import copy2
+import numpy as np
 from numpy import pi
 
 from mathutils import Matrix
@@ -50,6 +51,71 @@ class ExportedMaterialsCache:
         """
         return mat_id in self.mats.keys()
 
+class PluginCache:
+    '''
+    Store Mitsuba plugins instantiated during an export, so that they can be
+    reused by the next exports (e.g. the next frames of an animation) when
+    persistent data is enabled.
+    Entries are keyed by the name of what they were converted from, along with
+    a fingerprint of their content: a plugin is only converted and loaded
+    again if its fingerprint changed.
+    '''
+    def __init__(self):
+        self.entries = {} # key -> (fingerprint, structure, plugin)
+        self.used = set() # Keys used since the last pruning
+
+    def get(self, key, fingerprint):
+        '''
+        Return the cached plugin for the given key, if its fingerprint matches
+        '''
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != fingerprint:
+            return None
+        self.used.add(key)
+        return entry[2]
+
+    def put(self, key, fingerprint, plugin, structure=None):
+        self.entries[key] = (fingerprint, structure, plugin)
+        self.used.add(key)
+
+    def load(self, key, mts_dict):
+        '''
+        Load a scene dict entry, reusing the cached plugin if the entry did not
+        change. If only some values changed, they are copied to the cached
+        plugin through its parameters, so that the objects referencing it
+        remain valid.
+        '''
+        from mitsuba import load_dict, traverse
+        from .fingerprint import dict_fingerprint
+        fingerprint = dict_fingerprint(mts_dict)
+        plugin = self.get(key, fingerprint)
+        if plugin is not None:
+            return plugin
+
+        structure = dict_fingerprint(mts_dict, structure_only=True)
+        plugin = load_dict(mts_dict)
+        plugin.set_id(key)
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] == structure:
+            new_params = traverse(plugin)
+            params = traverse(entry[2])
+            if set(new_params.keys()) == set(params.keys()):
+                for param_key in new_params.keys():
+                    params[param_key] = new_params[param_key]
+                params.update()
+                plugin = entry[2]
+        self.put(key, fingerprint, plugin, structure)
+        return plugin
+
+    def prune(self):
+        '''
+        Drop the entries that were not used since the last pruning
+        '''
+        for key in list(self.entries.keys()):
+            if key not in self.used:
+                del self.entries[key]
+        self.used = set()
+
 class Files:
     MAIN = 0
     MATS = 1
@@ -69,6 +135,18 @@ class ExportContext:
         self.exported_mats = ExportedMaterialsCache()
         self.export_ids = False # Export Object IDs in the XML file
         self.exported_ids = set()
+        self.write_meshes = True # Save meshes as PLY files. Otherwise, meshes are kept in memory in the scene dict
+        self.object_shapes = {} # Blender object name -> IDs of the top-level shapes created for it
+        self.shared_meshes = {} # Blender object name -> shapegroup shared with the objects using the same mesh
+        self.plugin_cache = None # Plugins kept from previous exports, if persistent data is enabled
+        self.exported_textures = set() # Names of the images used by the scene
+        self.write_textures = True # Save textures in the export directory. Otherwise, they are kept in memory in the scene dict
+        self.image_bitmaps = {} # Image name -> Mitsuba bitmap, for textures kept in memory
+        self.executor = None # Thread pool running the tasks that don't need Blender data, if any
+        self.thread_env = None # Mitsuba thread environment of the thread pool
+        self.pending_tasks = [] # Futures of the tasks, in submission order
+        self.max_pending_tasks = None # Tasks in flight before waiting for the oldest one, None for no limit
+        self.mesh_cache = None # DiskCache of the PLY files written by previous exports, if any
         # All the args defined below are set in the Converter
         self.directory = ''
         self.axis_mat = Matrix() # Coordinate shift
@@ -88,16 +166,25 @@ class ExportContext:
         Otherwise the Id of the element is used if it exists
         or a new key is generated incrementally.
         '''
-        if mts_dict is None or not isinstance(mts_dict, dict) or len(mts_dict) == 0 or 'type' not in mts_dict:
+        if mts_dict is None:
             return False
 
+        if isinstance(mts_dict, dict):
+            if len(mts_dict) == 0 or 'type' not in mts_dict:
+                return False
+        else:
+            # Already instantiated Mitsuba objects (e.g. in-memory meshes) are added as is
+            from mitsuba import Object
+            if not isinstance(mts_dict, Object):
+                return False
+
         if not name:
             try:
                 name = mts_dict['id']
                 #remove the corresponding entry
                 del mts_dict['id']
 
-            except KeyError:
+            except (KeyError, TypeError): # TypeError: Mitsuba objects have no 'id' entry
                 name = 'elm__%i' % self.counter
 
         self.scene_data.update([(name, mts_dict)])
@@ -105,9 +192,59 @@ class ExportContext:
 
         return True
 
+    def run_task(self, task, *args):
+        '''
+        Run a task that doesn't access Blender data, such as converting a mesh or
+        writing a file. It runs on the thread pool of the export if there is one,
+        otherwise right away.
+        Once max_pending_tasks are in flight, this waits for the oldest one, so
+        that the data held by queued tasks (e.g. mesh buffers) stays bounded when
+        the thread pool falls behind.
+        '''
+        if self.executor is None:
+            task(*args)
+            return
+        self.pending_tasks.append(self.executor.submit(self.run_in_thread_env, task, *args))
+        if self.max_pending_tasks is not None:
+            while len(self.pending_tasks) > self.max_pending_tasks:
+                self.pending_tasks.pop(0).result()
+
+    def run_in_thread_env(self, task, *args):
+        from mitsuba import ScopedSetThreadEnvironment
+        with ScopedSetThreadEnvironment(self.thread_env):
+            task(*args)
+
+    def wait_tasks(self):
+        '''
+        Wait for all the submitted tasks. Raises the error of the first failed
+        one, in submission order, so that errors don't depend on the scheduling.
+        '''
+        pending_tasks, self.pending_tasks = self.pending_tasks, []
+        for future in pending_tasks:
+            future.result()
+
     def data_get(self, name):
         return self.scene_data.get(name)
 
+    def data_load(self, name):
+        '''
+        Instantiate the element of the scene dict with the given name, so that it
+        can be referenced by objects that are directly created in memory.
+        The element is replaced by the loaded object in the scene dict, so it is
+        only loaded once.
+        '''
+        mts_obj = self.scene_data.get(name)
+        if isinstance(mts_obj, dict):
+            if self.plugin_cache is not None:
+                mts_obj = self.plugin_cache.load(name, mts_obj)
+            else:
+                from mitsuba import load_dict
+                mts_obj = load_dict(mts_obj)
+                # Keep the same ID as if it was loaded along with the scene dict
+                mts_obj.set_id(name)
+            self.scene_data[name] = mts_obj
+        return mts_obj
+
     def log(self, message, level='INFO'):
         '''
         Log something using mitsuba's logging API
@@ -138,7 +275,58 @@ class ExportContext:
         image : The Blender Image object
         """
         # TODO: don't save packed images but convert them to a mitsuba texture, and let the XML writer save
+        self.exported_textures.add(image.name_full)
+        if self.plugin_cache is not None and not image.is_dirty:
+            # Images that did not change since the previous export don't need to be saved again
+            source_path = bpy.path.abspath(image.filepath, library=image.library)
+            fingerprint = (image.filepath, image.file_format,
+                           image.packed_file.size if image.packed_file else None,
+                           os.path.getmtime(source_path) if os.path.isfile(source_path) else None)
+            texture_key = ('texture', image.name_full)
+            filename = self.plugin_cache.get(texture_key, fingerprint)
+            if filename is None:
+                filename = self.save_texture(image)
+                self.plugin_cache.put(texture_key, fingerprint, filename)
+            return filename
+        return self.save_texture(image)
+
+    def image_params(self, image):
+        '''
+        Return the entries referencing an image in a bitmap or envmap plugin:
+        the path of the saved image, or the image itself if textures are kept in memory
+        '''
+        if not self.write_textures:
+            self.exported_textures.add(image.name_full)
+            return {'bitmap': self.image_bitmap(image)}
+        return {'filename': self.export_texture(image)}
+
+    def image_bitmap(self, image):
+        '''
+        Convert an image to a Mitsuba bitmap, without saving it
+        '''
+        bitmap = self.image_bitmaps.get(image.name_full)
+        if bitmap is None:
+            from mitsuba import Bitmap
+            width, height = image.size
+            pixels = np.empty(width * height * image.channels, dtype=np.float32)
+            image.pixels.foreach_get(pixels)
+            # Blender stores rows from the bottom up
+            pixels = np.ascontiguousarray(pixels.reshape(height, width, image.channels)[::-1])
+            bitmap = Bitmap(pixels)
+            # Byte images are stored as they are encoded, float ones are linear
+            bitmap.set_srgb_gamma(not image.is_float)
+            self.image_bitmaps[image.name_full] = bitmap
+        return bitmap
+
+    def save_texture(self, image):
+        '''
+        Save an image in the textures folder and return its relative path
+        '''
         textures_folder = os.path.join(self.directory, self.subfolders['texture'])
+        # Files on disk can be copied, unless they need to be converted
+        source_path = bpy.path.abspath(image.filepath, library=image.library)
+        use_copy = (image.source == 'FILE' and image.packed_file is None and not image.is_dirty
+                    and image.file_format not in convert_format and os.path.isfile(source_path))
         if image.file_format in convert_format:
             msg = "Image format of '%s' is not supported. Converting it to %s." % (image.name, convert_format[image.file_format])
             self.log(msg, 'WARN')
@@ -153,10 +341,16 @@ class ExportContext:
         target_path = os.path.join(textures_folder, name)
         if not os.path.isdir(textures_folder):
             os.makedirs(textures_folder)
-        old_filepath = image.filepath
-        image.filepath_raw = target_path
-        image.save()
-        image.filepath_raw = old_filepath
+        if use_copy:
+            # The file on disk is up to date, copy it rather than encoding the image again
+            if not os.path.exists(target_path) or not os.path.samefile(source_path, target_path):
+                self.run_task(copy2, source_path, target_path)
+        else:
+            # Saving needs Blender data, so it stays on the main thread
+            old_filepath = image.filepath
+            image.filepath_raw = target_path
+            image.save()
+            image.filepath_raw = old_filepath
         return f"{self.subfolders['texture']}/{name}"
 
     def spectrum(self, value, mode='rgb'):
@@ -0,0 +1,150 @@
+import hashlib
+import numpy as np
+
+def foreach_get(collection, attribute, dtype, components=1):
+    '''
+    Read an attribute of all the elements of a Blender collection at once
+    '''
+    data = np.empty(len(collection) * components, dtype=dtype)
+    if len(data) > 0:
+        collection.foreach_get(attribute, data)
+    return data
+
+def mesh_fingerprint(b_mesh):
+    '''
+    Hash the content of a Blender mesh that is used by its Mitsuba conversion:
+    topology, positions, shading, UVs, vertex colors and material slots.
+    '''
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(foreach_get(b_mesh.vertices, 'co', np.float32, 3))
+    hasher.update(foreach_get(b_mesh.loops, 'vertex_index', np.int32))
+    hasher.update(foreach_get(b_mesh.polygons, 'loop_total', np.int32))
+    hasher.update(foreach_get(b_mesh.polygons, 'material_index', np.int32))
+    hasher.update(foreach_get(b_mesh.polygons, 'use_smooth', bool))
+    if b_mesh.has_custom_normals:
+        hasher.update(foreach_get(b_mesh.loops, 'normal', np.float32, 3))
+    if getattr(b_mesh, 'use_auto_smooth', False): # Removed in Blender 4.1
+        hasher.update(repr(b_mesh.auto_smooth_angle).encode())
+    for uv_layer in b_mesh.uv_layers:
+        if uv_layer.active_render:
+            hasher.update(foreach_get(uv_layer.data, 'uv', np.float32, 2))
+    for color_layer in b_mesh.vertex_colors:
+        hasher.update(color_layer.name.encode())
+        hasher.update(foreach_get(color_layer.data, 'color', np.float32, 4))
+    hasher.update(repr([mat.name if mat else None for mat in b_mesh.materials]).encode())
+    return hasher.hexdigest()
+
+def matrix_fingerprint(matrix):
+    '''
+    Return a hashable copy of a Blender matrix
+    '''
+    if matrix is None:
+        return None
+    return tuple(value for row in matrix for value in row)
+
+def dict_fingerprint(mts_dict, structure_only=False):
+    '''
+    Return a hashable summary of a scene dict entry. Instantiated Mitsuba
+    objects are identified by their identity rather than their content.
+
+    Params
+    ------
+
+    mts_dict: The scene dict entry
+    structure_only: Ignore the values that can be changed through the
+                    parameters of the loaded plugin (floats, colors, transforms),
+                    to check whether two entries can be loaded as the same plugin.
+    '''
+    from mitsuba import Object
+    if isinstance(mts_dict, dict):
+        return tuple((key, dict_fingerprint(value, structure_only)) for key, value in mts_dict.items())
+    if isinstance(mts_dict, (list, tuple)):
+        return tuple(dict_fingerprint(value, structure_only) for value in mts_dict)
+    if isinstance(mts_dict, Object):
+        return ('object', id(mts_dict))
+    if structure_only and (isinstance(mts_dict, float) or not isinstance(mts_dict, (bool, int, str))):
+        # Floats and transforms
+        return 'value'
+    return repr(mts_dict)
+
+def has_refs(mts_dict):
+    '''
+    Check whether a scene dict entry references other entries of the scene dict.
+    Such entries cannot be loaded on their own.
+    '''
+    if not isinstance(mts_dict, dict):
+        return False
+    if mts_dict.get('type') == 'ref':
+        return True
+    return any(has_refs(value) for value in mts_dict.values())
+
+def update_content_hash(hasher, value):
+    '''
+    Hash a scene dict entry by content. Instantiated Mitsuba objects, such as
+    meshes converted in memory, are hashed through their parameters.
+    '''
+    from mitsuba import Object, traverse
+    if isinstance(value, dict):
+        for key, item in value.items():
+            hasher.update(repr(key).encode())
+            update_content_hash(hasher, item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            update_content_hash(hasher, item)
+    elif isinstance(value, Object):
+        hasher.update(type(value).__name__.encode())
+        params = traverse(value)
+        for key in sorted(params.keys()):
+            hasher.update(key.encode())
+            update_content_hash(hasher, params[key])
+    elif isinstance(value, (bool, int, float, str)) or value is None:
+        hasher.update(repr(value).encode())
+    else:
+        # Dr.Jit arrays, tensors and transforms
+        data = np.asarray(value)
+        if data.dtype == object:
+            hasher.update(repr(value).encode())
+        else:
+            hasher.update(np.ascontiguousarray(data).tobytes())
+
+def scene_fingerprint(scene_data, ignore_sample_count=True):
+    '''
+    Hash the content of a scene dict, e.g. to match saved renders with the scene they were rendered from.
+
+    Params
+    ------
+
+    scene_data: The scene dict
+    ignore_sample_count: Ignore the sample count of the sensors, so that more samples can be added to a render
+    '''
+    hasher = hashlib.blake2b(digest_size=16)
+    for name, mts_dict in scene_data.items():
+        hasher.update(repr(name).encode())
+        if ignore_sample_count and isinstance(mts_dict, dict) and 'film' in mts_dict:
+            mts_dict = {key: value for key, value in mts_dict.items() if key != 'sampler'}
+            # The sampler type still matters
+            hasher.update(repr(scene_data[name].get('sampler', {}).get('type')).encode())
+        update_content_hash(hasher, mts_dict)
+    return hasher.hexdigest()
+
+def referenced_files(mts_dict):
+    '''
+    Yield the paths of the files referenced by a scene dict entry, e.g. textures or meshes
+    '''
+    if isinstance(mts_dict, dict):
+        for key, value in mts_dict.items():
+            if key == 'filename' and isinstance(value, str):
+                yield value
+            else:
+                yield from referenced_files(value)
+
+def update_file_hash(hasher, filepath, chunk_size=1 << 20):
+    '''
+    Hash the content of a file, without reading it in memory at once
+    '''
+    with open(filepath, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
@@ -1,100 +1,470 @@
 import os
+import hashlib
+from shutil import copy2
 import bpy
+import numpy as np
 
 from .materials import export_material
 from .export_context import Files
+from .fingerprint import foreach_get, mesh_fingerprint, matrix_fingerprint
 
 
-def convert_mesh(export_ctx, b_mesh, matrix_world, name, mat_nr):
+def read_mesh(export_ctx, b_mesh, matrix_world, mat_nrs):
     '''
-    This method creates a mitsuba mesh from a blender mesh and returns it.
-    It constructs a dictionary containing the necessary info such as
-    pointers to blender's data strucures and then loads the BlenderMesh
-    plugin via load_dict.
+    Tessellate a blender mesh and copy the data needed to convert it.
+    This accesses Blender data, so it must run on the main thread, while the
+    conversion itself (split_mesh_data) can run on any thread.
+    Returns a dict of arrays, None if the mesh has no faces to export.
 
     Params
     ------
     export_ctx:   The export context.
     b_mesh:       The blender mesh to export.
-    matrix_world: The mesh's transform matrix.
-    name:         The name to give to the mesh. It will not be saved, so this is mostly
-                  for logging/debug purposes.
-    mat_nr:       The material ID to export.
+    matrix_world: The mesh's transform matrix, None to keep the mesh in local space.
+    mat_nrs:      The material slot indices to export.
     '''
-    from mitsuba import load_dict, Point3i
-    props = {
-        'type': 'blender',
-        'version': ".".join(map(str,bpy.app.version))
-    }
-
     if bpy.app.version < (4, 0, 0):
         b_mesh.calc_normals()
     # Compute the triangle tesselation
     b_mesh.calc_loop_triangles()
-
-    props['name'] = name
-    loop_tri_count = len(b_mesh.loop_triangles)
-    if loop_tri_count == 0:
-        export_ctx.log(f"Mesh: {name} has no faces. Skipping.", 'WARN')
-        return
-    props['loop_tri_count'] = loop_tri_count
+    loop_tris = b_mesh.loop_triangles
+    if len(loop_tris) == 0:
+        return None
+
+    tri_mats = foreach_get(loop_tris, 'material_index', np.int32)
+    # Like Blender, faces past the last slot use the last one
+    np.clip(tri_mats, 0, max(len(b_mesh.materials), 1) - 1, out=tri_mats)
+    tri_mask = np.isin(tri_mats, list(mat_nrs))
+    if not tri_mask.any():
+        return None
+    tri_smooth = foreach_get(loop_tris, 'use_smooth', bool)[tri_mask]
+    mesh_data = {
+        'tri_mats': tri_mats[tri_mask],
+        'tri_loops': foreach_get(loop_tris, 'loops', np.int32, 3).reshape(-1, 3)[tri_mask].ravel(),
+        'tri_verts': foreach_get(loop_tris, 'vertices', np.int32, 3).reshape(-1, 3)[tri_mask].ravel(),
+        'tri_smooth': tri_smooth,
+        'positions': foreach_get(b_mesh.vertices, 'co', np.float32, 3).reshape(-1, 3),
+        'vert_normals': None,
+        'tri_normals': None,
+        'uvs': None,
+        'colors': [],
+        'transform': None,
+    }
+    if tri_smooth.any():
+        # Smooth faces use vertex normals, flat ones the normal of their triangle
+        mesh_data['vert_normals'] = foreach_get(b_mesh.vertices, 'normal', np.float32, 3).reshape(-1, 3)
+        mesh_data['tri_normals'] = foreach_get(loop_tris, 'normal', np.float32, 3).reshape(-1, 3)[tri_mask]
 
     if len(b_mesh.uv_layers) > 1:
-        export_ctx.log(f"Mesh: '{name}' has multiple UV layers. Mitsuba only supports one. Exporting the one set active for render.", 'WARN')
+        export_ctx.log(f"Mesh: '{b_mesh.name}' has multiple UV layers. Mitsuba only supports one. Exporting the one set active for render.", 'WARN')
     for uv_layer in b_mesh.uv_layers:
         if uv_layer.active_render: # If there is only 1 UV layer, it is always active
-            if uv_layer.name in b_mesh.attributes:
-                props['uvs'] = b_mesh.attributes[uv_layer.name].data[0].as_pointer()
-            else:
-                props['uvs'] = uv_layer.data[0].as_pointer()
+            mesh_data['uvs'] = foreach_get(uv_layer.data, 'uv', np.float32, 2).reshape(-1, 2)
             break
 
     for color_layer in b_mesh.vertex_colors:
-        if color_layer.name in b_mesh.attributes:
-            props[f'vertex_{color_layer.name}'] = b_mesh.attributes[color_layer.name].data[0].as_pointer()
-        else:
-            props[f'vertex_{color_layer.name}'] = color_layer.data[0].as_pointer()
+        mesh_data['colors'].append((f'vertex_{color_layer.name}',
+                                    foreach_get(color_layer.data, 'color', np.float32, 4).reshape(-1, 4)))
+
+    if matrix_world is not None:
+        # Apply coordinate change
+        mesh_data['transform'] = np.array(export_ctx.axis_mat @ matrix_world, dtype=np.float64)
+    return mesh_data
+
+
+def mesh_data_parts(mesh_data):
+    '''
+    Return the material slot indices of the parts of a mesh read by read_mesh,
+    and whether they have vertex normals.
+    '''
+    if mesh_data is None:
+        return [], False
+    return np.unique(mesh_data['tri_mats']).tolist(), mesh_data['vert_normals'] is not None
 
-    props['loop_tris'] = b_mesh.loop_triangles[0].as_pointer()
 
-    if '.corner_vert' in b_mesh.attributes:
-        # Blender 3.6+ layout
-        props['loops'] = b_mesh.attributes['.corner_vert'].data[0].as_pointer()
+def split_mesh_data(mesh_data):
+    '''
+    Split a mesh read by read_mesh by material slot, in a single pass over its
+    triangles. Corners sharing the same vertex, normal, UV and colors are
+    merged into a single vertex.
+    Corners are merged on compact keys: their material and vertex packed in
+    64 bits, followed by the float32 attributes they are split by. With UVs
+    and flat faces, that is 28 bytes per corner, e.g. 3.4 GB of keys for 40M
+    triangles. Normals of fully smooth meshes only depend on the vertex, and
+    are left out of the keys.
+    Returns a dict of material slot index -> dict of vertex and face arrays.
+    '''
+    if mesh_data is None:
+        return {}
+    tri_mats = mesh_data['tri_mats']
+    tri_loops = mesh_data['tri_loops']
+    tri_verts = mesh_data['tri_verts']
+
+    # Material and vertex of each corner. Keys are compared bytewise once packed with the
+    # attributes, they are big-endian so that the vertices of each material are contiguous
+    corner_keys = np.repeat(tri_mats, 3).astype(np.uint64) << np.uint64(32)
+    corner_keys |= tri_verts.astype(np.uint64)
+
+    # Attributes the corners are split by, as (name, width)
+    attributes = []
+    has_normals = mesh_data['vert_normals'] is not None
+    split_normals = has_normals and not mesh_data['tri_smooth'].all()
+    if split_normals:
+        attributes.append(('normals', 3))
+    has_uvs = mesh_data['uvs'] is not None
+    if has_uvs:
+        attributes.append(('uvs', 2))
+    for color_name, _ in mesh_data['colors']:
+        attributes.append((color_name, 3))
+
+    if attributes:
+        corner_dtype = np.dtype([('key', '>u8')] + [(name, np.float32, (width,)) for name, width in attributes])
+        corners = np.empty(len(corner_keys), dtype=corner_dtype)
+        corners['key'] = corner_keys
+        del corner_keys
+        if split_normals:
+            # Smooth faces use vertex normals, flat ones the normal of their triangle
+            normals = corners['normals']
+            normals[...] = mesh_data['vert_normals'][tri_verts]
+            flat = ~np.repeat(mesh_data['tri_smooth'], 3)
+            normals[flat] = np.repeat(mesh_data['tri_normals'], 3, axis=0)[flat]
+            del flat
+        if has_uvs:
+            uvs = corners['uvs']
+            uvs[...] = mesh_data['uvs'][tri_loops]
+            # Blender's V axis points up, Mitsuba's points down
+            uvs[:, 1] = 1.0 - uvs[:, 1]
+        for color_name, loop_colors in mesh_data['colors']:
+            corners[color_name] = loop_colors[tri_loops, :3]
+        vertices, corner_vertices = np.unique(corners.view(f'V{corner_dtype.itemsize}'), return_inverse=True)
+        del corners
+        vertices = vertices.view(corner_dtype)
+        vertex_keys = vertices['key'].astype(np.uint64)
     else:
-        props['loops'] = b_mesh.loops[0].as_pointer()
+        vertex_keys, corner_vertices = np.unique(corner_keys, return_inverse=True)
+        del corner_keys
+    corner_vertices = corner_vertices.reshape(-1)
+
+    vertex_mats = (vertex_keys >> np.uint64(32)).astype(np.int32)
+    vertex_verts = (vertex_keys & np.uint64(0xffffffff)).astype(np.int64)
+    positions = mesh_data['positions'][vertex_verts]
+    normals = None
+    if split_normals:
+        normals = vertices['normals']
+    elif has_normals:
+        normals = mesh_data['vert_normals'][vertex_verts]
+    uvs = vertices['uvs'] if has_uvs else None
+    colors = {color_name: vertices[color_name] for color_name, _ in mesh_data['colors']}
+
+    transform = mesh_data['transform']
+    if transform is not None:
+        positions = positions @ transform[:3, :3].T + transform[:3, 3]
+        if normals is not None:
+            normals = normals @ np.linalg.inv(transform[:3, :3])
+            normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+
+    parts = {}
+    faces = corner_vertices.reshape(-1, 3)
+    for mat_nr in np.unique(tri_mats):
+        start, end = np.searchsorted(vertex_mats, [mat_nr, mat_nr + 1])
+        parts[int(mat_nr)] = {
+            'positions': positions[start:end],
+            'normals': normals[start:end] if normals is not None else None,
+            'uvs': uvs[start:end] if uvs is not None else None,
+            'colors': {color_name: values[start:end] for color_name, values in colors.items()},
+            'faces': faces[tri_mats == mat_nr] - start,
+        }
+    return parts
+
+
+def split_mesh(export_ctx, b_mesh, matrix_world, mat_nrs):
+    '''
+    Tessellate a blender mesh and split it by material slot.
+    Returns a dict of material slot index -> dict of vertex and face arrays,
+    slots without faces are left out.
+    '''
+    return split_mesh_data(read_mesh(export_ctx, b_mesh, matrix_world, mat_nrs))
+
+
+def create_mesh(name, part, material_params=None):
+    '''
+    Create a mitsuba mesh from the arrays of a mesh part, as returned by split_mesh.
 
-    if 'sharp_face' in b_mesh.attributes:
-        props['sharp_face'] = b_mesh.attributes['sharp_face'].data[0].as_pointer()
+    Params
+    ------
+    name:         The name to give to the mesh. It will not be saved, so this is mostly
+                  for logging/debug purposes.
+    part:         The vertex and face arrays of the mesh.
+    material_params: Optional instantiated BSDF (and emitter) to attach to the mesh.
+                  This is required for meshes that are kept in memory, as they cannot
+                  reference plugins of the scene dict.
+    '''
+    from mitsuba import Mesh, Properties, traverse
+    props = Properties()
+    for key, value in (material_params or {}).items():
+        props[key] = value
+    mts_mesh = Mesh(name,
+                    vertex_count=len(part['positions']),
+                    face_count=len(part['faces']),
+                    props=props,
+                    has_vertex_normals=part['normals'] is not None,
+                    has_vertex_texcoords=part['uvs'] is not None)
+    params = traverse(mts_mesh)
+    # Mesh buffers have the same type whatever the variant
+    Storage = type(params['vertex_positions'])
+    params['vertex_positions'] = Storage(np.ravel(part['positions']).astype(np.float32))
+    params['faces'] = type(params['faces'])(np.ravel(part['faces']).astype(np.uint32))
+    if part['normals'] is not None:
+        params['vertex_normals'] = Storage(np.ravel(part['normals']).astype(np.float32))
+    if part['uvs'] is not None:
+        params['vertex_texcoords'] = Storage(np.ravel(part['uvs']).astype(np.float32))
+    for color_name, values in part['colors'].items():
+        mts_mesh.add_attribute(color_name, 3, Storage(np.ravel(values).astype(np.float32)))
+    params.update()
+    return mts_mesh
+
+
+def get_material_params(export_ctx, b_mat):
+    '''
+    Return the BSDF and emitter entries of a mesh using the given material.
+    When meshes are kept in memory, the BSDF and emitter are instantiated,
+    otherwise the BSDF is referenced by its ID.
 
-    if bpy.app.version >= (3, 6, 0):
-        props['polys'] = b_mesh.loop_triangle_polygons[0].as_pointer()
+    Params
+    ------
+    export_ctx: The export context.
+    b_mat:      The blender material of the mesh, None to use the default BSDF.
+    '''
+    emitter = None
+    if b_mat is None:
+        if not export_ctx.data_get('default-bsdf'): # We only need to add it once
+            default_bsdf = {
+                'type': 'twosided',
+                'id': 'default-bsdf',
+                'bsdf': {'type':'diffuse'}
+            }
+            export_ctx.data_add(default_bsdf)
+        bsdf_id = 'default-bsdf'
     else:
-        props['polys'] = b_mesh.polygons[0].as_pointer()
+        mat_id = f"mat-{b_mat.name}"
+        if export_ctx.exported_mats.has_mat(mat_id): # Add one emitter *and* one bsdf
+            mixed_mat = export_ctx.exported_mats.mats[mat_id]
+            bsdf_id = mixed_mat['bsdf']
+            emitter = mixed_mat['emitter']
+        else:
+            bsdf_id = mat_id
 
-    if 'position' in b_mesh.attributes:
-        # Blender 3.5+ layout
-        props['verts'] = b_mesh.attributes['position'].data[0].as_pointer()
+    if export_ctx.write_meshes:
+        params = {'bsdf': {'type':'ref', 'id':bsdf_id}}
+        if emitter is not None:
+            params['emitter'] = emitter
     else:
-        props['verts'] = b_mesh.vertices[0].as_pointer()
+        from mitsuba import load_dict
+        params = {'bsdf': export_ctx.data_load(bsdf_id)}
+        if emitter is not None:
+            # Emitters are attached to a single shape, so each mesh gets its own
+            params['emitter'] = load_dict(emitter)
 
-    if bpy.app.version > (3, 0, 0):
-        props['normals'] = b_mesh.vertex_normals[0].as_pointer()
+    return params
 
-    props['vert_count'] = len(b_mesh.vertices)
-    # Apply coordinate change
-    if matrix_world:
-        props['to_world'] = export_ctx.transform_matrix(matrix_world)
 
-    # material index to export, as only a single material per mesh is suported in mitsuba
-    props['mat_nr'] = mat_nr
-    if 'material_index' in b_mesh.attributes:
-        # Blender 3.4+ layout
-        props['mat_indices'] = b_mesh.attributes['material_index'].data[0].as_pointer()
-    else:
-        props['mat_indices'] = 0
+def exported_slots(b_mesh):
+    '''
+    Return the material slot indices of a blender mesh to export
+    '''
+    if len(b_mesh.materials) == 0: # No assigned material
+        return [0]
+    # Slots without material are not exported
+    return [mat_nr for mat_nr, mat in enumerate(b_mesh.materials) if mat]
+
+
+def name_parts(export_ctx, b_mesh, mat_nrs, name_clean):
+    '''
+    Name the parts of a mesh with faces in the given material slots, and
+    export their materials.
+    Returns a list of (material slot index, name, material) tuples.
+    '''
+    if len(b_mesh.materials) == 0: # No assigned material
+        return [(mat_nr, name_clean, None) for mat_nr in mat_nrs]
+
+    named_parts = []
+    refs_per_mat = {}
+    for mat_nr in mat_nrs:
+        mat = b_mesh.materials[mat_nr]
+
+        # Ensures that the exported mesh parts have unique names,
+        # even if multiple material slots refer to the same material.
+        n_mat_refs = refs_per_mat.get(mat.name, 0)
+        name = f'{name_clean}-{mat.name}'
+
+        if n_mat_refs >= 1:
+            name += f'-{n_mat_refs:03d}'
+        else:
+            # Only export this material once. In-memory meshes are created
+            # along with their material, so it needs to be exported first
+            export_material(export_ctx, mat)
+
+        named_parts.append((mat_nr, name, mat))
+        refs_per_mat[mat.name] = n_mat_refs + 1
+    return named_parts
+
+
+def convert_parts(export_ctx, b_mesh, transform, name_clean):
+    '''
+    Convert a blender mesh into one mitsuba mesh per material slot.
+    Returns a list of (name, material, mitsuba mesh) tuples.
+    '''
+    parts = split_mesh(export_ctx, b_mesh, transform, exported_slots(b_mesh))
+    if not parts:
+        export_ctx.log(f"Mesh: {name_clean} has no faces. Skipping.", 'WARN')
+        return []
 
-    # Return the mitsuba mesh
-    return load_dict(props)
+    converted_parts = []
+    for (mat_nr, name, mat) in name_parts(export_ctx, b_mesh, sorted(parts), name_clean):
+        material_params = None if export_ctx.write_meshes else get_material_params(export_ctx, mat)
+        converted_parts.append((name, mat, create_mesh(name, parts[mat_nr], material_params)))
+    return converted_parts
+
+
+def mesh_data_key(mesh_data):
+    '''
+    Hash a mesh read by read_mesh, to identify the PLY files written from it
+    '''
+    from mitsuba import MI_VERSION
+    hasher = hashlib.blake2b(digest_size=16)
+    # The PLY writer may change between versions
+    hasher.update(MI_VERSION.encode())
+    for key, value in mesh_data.items():
+        hasher.update(key.encode())
+        for item in (value if key == 'colors' else [value]):
+            if isinstance(item, tuple): # Named vertex colors
+                hasher.update(item[0].encode())
+                item = item[1]
+            if item is None:
+                hasher.update(b'None')
+            else:
+                hasher.update(repr((item.dtype.str, item.shape)).encode())
+                hasher.update(np.ascontiguousarray(item).tobytes())
+    return hasher.hexdigest()
+
+
+def link_file(source, target):
+    '''
+    Hard link a file, or copy it if it cannot be linked (e.g. across drives).
+    Returns False if the source file doesn't exist.
+    '''
+    if source is None:
+        return False
+    try:
+        if os.path.lexists(target):
+            os.remove(target)
+        os.link(source, target)
+    except FileNotFoundError:
+        return False # Evicted from the cache in the meantime
+    except OSError:
+        try:
+            copy2(source, target)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def write_parts(mesh_data, filepaths, mesh_cache=None):
+    '''
+    Convert a mesh read by read_mesh and save its parts as binary PLY files.
+    This doesn't access Blender data, so it can run on any thread.
+
+    Params
+    ------
+    mesh_data:  The mesh data, as returned by read_mesh.
+    filepaths:  List of (material slot index, name, path) of the parts to save.
+    mesh_cache: Optional DiskCache of PLY files. Parts of meshes that were
+                already written are linked from it rather than written again.
+    '''
+    parts = None
+    mesh_key = mesh_data_key(mesh_data) if mesh_cache is not None else None
+    for (mat_nr, name, filepath) in filepaths:
+        if mesh_cache is not None:
+            key = f'{mesh_key}-{mat_nr}'
+            if link_file(mesh_cache.get(key), filepath):
+                continue
+        if parts is None:
+            parts = split_mesh_data(mesh_data)
+        mts_mesh = create_mesh(name, parts[mat_nr])
+        if mesh_cache is None or not link_file(mesh_cache.put(key, mts_mesh.write_ply, evict=False), filepath):
+            if os.path.lexists(filepath):
+                # It may be linked to a cached file, which must not be overwritten
+                os.remove(filepath)
+            mts_mesh.write_ply(filepath)
+
+
+def material_fingerprint(export_ctx, b_mesh):
+    '''
+    Identify the instantiated BSDFs and emitters the parts of a mesh are
+    created with, when meshes are kept in memory.
+    '''
+    fingerprint = []
+    if len(b_mesh.materials) == 0:
+        get_material_params(export_ctx, None) # Make sure the default BSDF exists
+        fingerprint.append(id(export_ctx.data_load('default-bsdf')))
+    for mat in b_mesh.materials:
+        if not mat:
+            continue
+        export_material(export_ctx, mat)
+        mat_id = f"mat-{mat.name}"
+        if export_ctx.exported_mats.has_mat(mat_id):
+            mixed_mat = export_ctx.exported_mats.mats[mat_id]
+            fingerprint.append((id(export_ctx.data_load(mixed_mat['bsdf'])), repr(mixed_mat['emitter'])))
+        else:
+            fingerprint.append(id(export_ctx.data_load(mat_id)))
+    return tuple(fingerprint)
+
+
+def find_shared_meshes(objects):
+    '''
+    Find the meshes used by several objects, either because the objects share
+    the same mesh datablock or because their meshes are identical.
+    Returns a dict of object name -> name of the shapegroup shared by its
+    users, named after the first one. Meshes used once are left out.
+
+    Params
+    ------
+    objects: The evaluated mesh objects to consider, in export order.
+    '''
+    mesh_hashes = {} # Evaluated meshes are shared by objects without modifiers
+    users = {}
+    for b_object in objects:
+        b_mesh = b_object.data
+        mesh_hash = mesh_hashes.get(b_mesh.as_pointer())
+        if mesh_hash is None:
+            mesh_hash = mesh_fingerprint(b_mesh)
+            mesh_hashes[b_mesh.as_pointer()] = mesh_hash
+        # Objects can override the materials of their mesh
+        key = (mesh_hash, tuple(slot.material.name if slot.material else None for slot in b_object.material_slots))
+        users.setdefault(key, []).append(b_object.name_full)
+
+    shared_meshes = {}
+    for object_names in users.values():
+        if len(object_names) > 1:
+            group_name = bpy.path.clean_name(object_names[0])
+            for object_name in object_names:
+                shared_meshes[object_name] = group_name
+    return shared_meshes
+
+
+def has_emitter_material(export_ctx, b_mesh):
+    '''
+    Check if any material of a mesh emits light. Shapes of a shapegroup cannot
+    be emitters.
+    '''
+    for mat in b_mesh.materials:
+        if not mat:
+            continue
+        export_material(export_ctx, mat)
+        mixed_mat = export_ctx.exported_mats.mats.get(f"mat-{mat.name}")
+        if mixed_mat is not None and mixed_mat.get('emitter') is not None:
+            return True
+    return False
 
 
 def export_object(deg_instance, export_ctx, is_particle):
@@ -110,6 +480,14 @@ def export_object(deg_instance, export_ctx, is_particle):
     is_instance_emitter = b_object.parent is not None and b_object.parent.is_instancer
     is_instance = deg_instance.is_instance
 
+    # Objects sharing their mesh with others are exported as instances of a single shapegroup
+    shared_mesh = export_ctx.shared_meshes.get(b_object.name_full)
+    is_shared = (shared_mesh is not None and not (is_instance or is_instance_emitter or is_particle)
+                 and not has_emitter_material(export_ctx, b_object.data))
+    if is_shared:
+        name_clean = shared_mesh
+        object_id = f"mesh-{name_clean}"
+
     # Only write to file objects that have never been exported before
     if export_ctx.data_get(object_id) is None:
         if b_object.type == 'MESH':
@@ -118,110 +496,94 @@ def export_object(deg_instance, export_ctx, is_particle):
             b_mesh = b_object.to_mesh()
 
         # Convert the mesh into one mitsuba mesh per different material
-        mat_count = len(b_mesh.materials)
-        converted_parts = []
-        if is_instance or is_instance_emitter:
+        if is_instance or is_instance_emitter or is_shared:
             transform = None
         else:
             transform = b_object.matrix_world
 
-
-        if mat_count == 0: # No assigned material
-            mts_mesh = convert_mesh(export_ctx, b_mesh, transform, name_clean, 0)
-            if mts_mesh is not None and mts_mesh.face_count() > 0:
-                converted_parts.append((name_clean, -1, mts_mesh))
-        else:
-            refs_per_mat = {}
-            for mat_nr in range(mat_count):
-                mat = b_mesh.materials[mat_nr]
-                if not mat:
-                    continue
-
-                # Ensures that the exported mesh parts have unique names,
-                # even if multiple material slots refer to the same material.
-                n_mat_refs = refs_per_mat.get(mat.name, 0)
-                name = f'{name_clean}-{mat.name}'
-
-                if n_mat_refs >= 1:
-                    name += f'-{n_mat_refs:03d}'
-
-                mts_mesh = convert_mesh(export_ctx,
-                                        b_mesh,
-                                        transform,
-                                        name,
-                                        mat_nr)
-                if mts_mesh is not None and mts_mesh.face_count() > 0:
-                    converted_parts.append((name, mat_nr, mts_mesh))
-                    refs_per_mat[mat.name] = n_mat_refs + 1
-
-                    if n_mat_refs == 0:
-                        # Only export this material once
-                        export_material(export_ctx, mat)
-
-        if b_object.type != 'MESH':
-            b_object.to_mesh_clear()
-
         # Use a ShapeGroup for instances and split meshes
-        use_shapegroup = is_instance or is_instance_emitter or is_particle
+        use_shapegroup = is_instance or is_instance_emitter or is_particle or is_shared
         # TODO: Check if shapegroups for split meshes is worth it
         if use_shapegroup:
             group = {
                 'type': 'shapegroup'
             }
 
-        for (name, mat_nr, mts_mesh) in converted_parts:
-            name = name_clean if len(converted_parts) == 1 else name
-            mesh_id = f"mesh-{name}"
-
-            # Save as binary ply
+        if export_ctx.write_meshes:
+            # Only read the mesh here, it is converted and saved by a background task
+            mesh_data = read_mesh(export_ctx, b_mesh, transform, exported_slots(b_mesh))
+            mat_nrs, has_normals = mesh_data_parts(mesh_data)
+            if not mat_nrs:
+                export_ctx.log(f"Mesh: {name_clean} has no faces. Skipping.", 'WARN')
+            named_parts = name_parts(export_ctx, b_mesh, mat_nrs, name_clean)
             mesh_folder = os.path.join(export_ctx.directory, export_ctx.subfolders['shape'])
-            if not os.path.isdir(mesh_folder):
+            if named_parts and not os.path.isdir(mesh_folder):
                 os.makedirs(mesh_folder)
-            filepath = os.path.join(mesh_folder,  f"{name}.ply")
-            mts_mesh.write_ply(filepath)
-
-            # Build dictionary entry
-            params = {
-                'type': 'ply',
-                'filename': f"{export_ctx.subfolders['shape']}/{name}.ply"
-            }
+            filepaths = []
+            shapes = []
+            for (mat_nr, name, b_mat) in named_parts:
+                name = name_clean if len(named_parts) == 1 else name
+                filepaths.append((mat_nr, name, os.path.join(mesh_folder, f"{name}.ply")))
+
+                # Build dictionary entry
+                params = {
+                    'type': 'ply',
+                    'filename': f"{export_ctx.subfolders['shape']}/{name}.ply"
+                }
+
+                # Add flat shading flag if needed
+                if not has_normals:
+                    params["face_normals"] = True
+
+                # Add material info
+                params.update(get_material_params(export_ctx, b_mat))
+                shapes.append((name, params))
+            if filepaths:
+                # Save as binary ply
+                export_ctx.run_task(write_parts, mesh_data, filepaths, export_ctx.mesh_cache)
+        else:
+            converted_parts = None
+            fingerprint = None
+            if export_ctx.plugin_cache is not None:
+                # Reuse the meshes converted by a previous export if nothing changed
+                fingerprint = (mesh_fingerprint(b_mesh),
+                               matrix_fingerprint(transform),
+                               material_fingerprint(export_ctx, b_mesh))
+                converted_parts = export_ctx.plugin_cache.get(('parts', object_id), fingerprint)
+
+            if converted_parts is None:
+                converted_parts = convert_parts(export_ctx, b_mesh, transform, name_clean)
+                if fingerprint is not None:
+                    # Materials are only needed to write meshes, don't keep references to them
+                    export_ctx.plugin_cache.put(('parts', object_id), fingerprint, [(name, None, mts_mesh) for (name, _, mts_mesh) in converted_parts])
+
+            shapes = []
+            for (name, _, mts_mesh) in converted_parts:
+                name = name_clean if len(converted_parts) == 1 else name
+                # The mesh already holds its material, hand it over as is
+                if export_ctx.export_ids:
+                    mts_mesh.set_id(f"mesh-{name}")
+                shapes.append((name, mts_mesh))
 
-            # Add flat shading flag if needed
-            if not mts_mesh.has_vertex_normals():
-                params["face_normals"] = True
-
-            # Add material info
-            if mat_nr == -1:
-                if not export_ctx.data_get('default-bsdf'): # We only need to add it once
-                    default_bsdf = {
-                        'type': 'twosided',
-                        'id': 'default-bsdf',
-                        'bsdf': {'type':'diffuse'}
-                    }
-                    export_ctx.data_add(default_bsdf)
-                params['bsdf'] = {'type':'ref', 'id':'default-bsdf'}
-            else:
-                mat_id = f"mat-{b_object.data.materials[mat_nr].name}"
-                if export_ctx.exported_mats.has_mat(mat_id): # Add one emitter *and* one bsdf
-                    mixed_mat = export_ctx.exported_mats.mats[mat_id]
-                    params['bsdf'] = {'type':'ref', 'id':mixed_mat['bsdf']}
-                    params['emitter'] = mixed_mat['emitter']
-                else:
-                    params['bsdf'] = {'type':'ref', 'id':mat_id}
+        if b_object.type != 'MESH':
+            b_object.to_mesh_clear()
 
+        for (name, params) in shapes:
+            mesh_id = f"mesh-{name}"
             # Add dict to the scene dict
             if use_shapegroup:
                 group[name] = params
             else:
                 if export_ctx.export_ids:
                     export_ctx.data_add(params, name=mesh_id)
+                    export_ctx.object_shapes.setdefault(b_object.name_full, []).append(mesh_id)
                 else:
                     export_ctx.data_add(params)
 
         if use_shapegroup:
             export_ctx.data_add(group, name=object_id)
 
-    if is_instance or is_particle:
+    if is_instance or is_particle or is_shared:
         params = {
             'type': 'instance',
             'shape': {
@@ -230,4 +592,9 @@ def export_object(deg_instance, export_ctx, is_particle):
             },
             'to_world': export_ctx.transform_matrix(deg_instance.matrix_world)
         }
-        export_ctx.data_add(params)
+        if is_shared and export_ctx.export_ids:
+            instance_id = f"instance-{bpy.path.clean_name(b_object.name_full)}"
+            export_ctx.data_add(params, name=instance_id)
+            export_ctx.object_shapes.setdefault(b_object.name_full, []).append(instance_id)
+        else:
+            export_ctx.data_add(params)
@@ -0,0 +1,304 @@
+import os
+import bpy
+
+from . import SceneConverter, particle_objects
+from . import materials
+from .fingerprint import mesh_fingerprint, matrix_fingerprint
+
+class IncrementalExporter:
+    '''
+    Keep an exported XML scene in sync with the Blender scene. After a full
+    export, only the objects, materials, lights and world that Blender flags
+    as updated are converted again, and the XML files are rewritten from the
+    updated scene dict.
+    A manifest of the last export maps each object to the IDs of its plugins,
+    the files they reference and a fingerprint of its mesh, so that updates
+    that don't change what is exported are skipped.
+
+    Params
+    ------
+
+    filepath: Path of the scene XML file
+    split_files: Split the XML file in fragments
+    settings: Attributes to set on the SceneConverter, or on its export context
+              for those it has (e.g. 'use_selection' or 'axis_mat')
+    '''
+    # Delay between the last update and the export, so that interactive edits are exported once
+    delay = 0.25
+
+    def __init__(self, filepath, split_files, settings):
+        self.filepath = filepath
+        self.split_files = split_files
+        self.settings = settings
+        self.converter = None
+        self.scene_name = None
+        self.object_names = set()
+        self.manifest = {} # Object name -> {'ids': [...], 'files': [...], 'fingerprint': ...}
+        self.integrator_key = None
+        self.scene_fingerprint = None
+        # Pending updates
+        self.updated_objects = set()
+        self.updated_data = set()
+        self.updated_materials = set()
+        self.updated_world = False
+        self.updated_scene = False
+        self.timer_registered = False
+        # Timers are identified by their function, bound methods are created on each access
+        self.flush_callback = self.flush
+
+    def create_converter(self):
+        converter = SceneConverter()
+        for name, value in self.settings.items():
+            target = converter.export_ctx if hasattr(converter.export_ctx, name) else converter
+            setattr(target, name, value)
+        # Plugins are matched with their objects by ID
+        converter.export_ctx.export_ids = True
+        # Users keep editing while the scene is watched
+        converter.switch_to_object_mode = False
+        return converter
+
+    def write_xml(self):
+        # A new writer is needed for each write
+        self.converter.set_path(self.filepath, split_files=self.split_files)
+        self.converter.dict_to_xml()
+
+    def export_all(self, depsgraph):
+        '''
+        Export the whole scene and build the manifest
+        '''
+        self.converter = self.create_converter()
+        self.converter.set_path(self.filepath, split_files=self.split_files)
+        self.converter.scene_to_dict(depsgraph)
+        self.converter.dict_to_xml()
+        # The integrator is the first entry after the scene type
+        self.integrator_key = list(self.converter.export_ctx.scene_data)[1]
+        self.scene_name = depsgraph.scene.name_full
+        self.scene_fingerprint = self.render_fingerprint(depsgraph.scene)
+        self.object_names = {obj.name_full for obj in depsgraph.objects}
+        particles = particle_objects()
+        self.manifest = {}
+        for b_object in depsgraph.objects:
+            if is_instanced(self.converter.export_ctx, b_object, particles):
+                # Instancing is only handled by full exports
+                continue
+            self.manifest[b_object.name_full] = self.object_entry(b_object)
+
+    def render_fingerprint(self, b_scene):
+        '''
+        Identify the render settings the integrator and cameras are exported from
+        '''
+        render = b_scene.render
+        cycles = getattr(b_scene, 'cycles', None)
+        return (repr(self.converter.integrator_dict(b_scene)),
+                render.engine, render.resolution_x, render.resolution_y, render.resolution_percentage,
+                cycles.samples if cycles else None,
+                cycles.pixel_filter_type if cycles else None,
+                cycles.filter_width if cycles else None)
+
+    def object_entry(self, b_object):
+        export_ctx = self.converter.export_ctx
+        if b_object.type == 'LIGHT':
+            ids = [f"emit-{b_object.name_full}"]
+        elif b_object.type == 'CAMERA':
+            ids = [b_object.name_full]
+        else:
+            ids = list(export_ctx.object_shapes.get(b_object.name_full, []))
+        ids = [plugin_id for plugin_id in ids if plugin_id in export_ctx.scene_data]
+        files = []
+        for plugin_id in ids:
+            plugin = export_ctx.scene_data[plugin_id]
+            if isinstance(plugin, dict) and isinstance(plugin.get('filename'), str):
+                files.append(plugin['filename'])
+        return {
+            'ids': ids,
+            'files': files,
+            'fingerprint': object_fingerprint(b_object),
+        }
+
+    def add_updates(self, depsgraph):
+        '''
+        Record the datablocks flagged as updated by Blender
+        '''
+        for update in depsgraph.updates:
+            datablock = update.id
+            if isinstance(datablock, bpy.types.Object):
+                # Objects whose export didn't change are skipped by their fingerprint
+                self.updated_objects.add(datablock.name_full)
+            elif isinstance(datablock, bpy.types.Material):
+                # Exported materials are identified by their name, without library
+                self.updated_materials.add(datablock.name)
+            elif isinstance(datablock, bpy.types.World):
+                self.updated_world = True
+            elif isinstance(datablock, bpy.types.Scene):
+                self.updated_scene = True
+            elif isinstance(datablock, (bpy.types.Mesh, bpy.types.Light, bpy.types.Camera, bpy.types.Curve, bpy.types.MetaBall)):
+                self.updated_data.add(datablock.name_full)
+
+    def has_updates(self):
+        return bool(self.updated_objects or self.updated_data or self.updated_materials
+                    or self.updated_world or self.updated_scene)
+
+    def clear_updates(self):
+        self.updated_objects = set()
+        self.updated_data = set()
+        self.updated_materials = set()
+        self.updated_world = False
+        self.updated_scene = False
+
+    def update(self, depsgraph):
+        '''
+        Export the pending updates, or the whole scene if they cannot be applied incrementally
+        '''
+        export_ctx = self.converter.export_ctx
+        particles = particle_objects()
+        objects = {b_object.name_full: b_object for b_object in depsgraph.objects}
+        if set(objects) != self.object_names:
+            # Objects were added or removed
+            self.export_all(depsgraph)
+            return
+
+        # The scene is flagged as updated by most edits, only export it if its settings changed
+        scene_changed = False
+        if self.updated_scene:
+            scene_fingerprint = self.render_fingerprint(depsgraph.scene)
+            scene_changed = scene_fingerprint != self.scene_fingerprint
+            self.scene_fingerprint = scene_fingerprint
+
+        # Objects whose data or materials changed are exported again
+        forced = set()
+        for name, b_object in objects.items():
+            if b_object.data is not None and b_object.data.name_full in self.updated_data:
+                forced.add(name)
+            if any(slot.material and slot.material.name in self.updated_materials for slot in b_object.material_slots):
+                forced.add(name)
+        if scene_changed:
+            # Cameras depend on the render settings
+            forced.update(name for name, b_object in objects.items() if b_object.type == 'CAMERA')
+
+        updated = set()
+        for name in self.updated_objects | forced:
+            b_object = objects.get(name)
+            if b_object is None:
+                continue
+            if name not in self.manifest or is_instanced(export_ctx, b_object, particles):
+                self.export_all(depsgraph)
+                return
+            fingerprint = object_fingerprint(b_object)
+            if name in forced or fingerprint is None or fingerprint != self.manifest[name]['fingerprint']:
+                updated.add(name)
+
+        if not updated and not self.updated_materials and not self.updated_world and not scene_changed:
+            return
+
+        export_ctx.deg = depsgraph
+        b_scene = depsgraph.scene
+        if scene_changed:
+            export_ctx.scene_data[self.integrator_key] = self.converter.integrator_dict(b_scene)
+        if self.updated_world:
+            export_ctx.scene_data.pop("World", None)
+            materials.export_world(export_ctx, b_scene.world, self.converter.ignore_background)
+        for name in self.updated_materials:
+            # Exported again along with the objects using them
+            export_ctx.scene_data.pop(f"mat-{name}", None)
+            export_ctx.exported_mats.mats.pop(f"mat-{name}", None)
+
+        for name in updated:
+            for plugin_id in self.manifest[name]['ids']:
+                export_ctx.scene_data.pop(plugin_id, None)
+            export_ctx.object_shapes.pop(name, None)
+        for object_instance in depsgraph.object_instances:
+            if not object_instance.is_instance and object_instance.object.name_full in updated:
+                self.converter.export_instance(object_instance, b_scene, particles)
+
+        for name in updated:
+            entry = self.object_entry(objects[name])
+            # Remove the files the object doesn't use anymore
+            for filename in set(self.manifest[name]['files']) - set(entry['files']):
+                filepath = os.path.join(export_ctx.directory, filename)
+                if os.path.isfile(filepath):
+                    os.remove(filepath)
+            self.manifest[name] = entry
+
+        self.write_xml()
+        # Meshes written again were added to the mesh cache
+        self.converter.evict_mesh_cache()
+
+    def flush(self):
+        '''
+        Timer callback exporting the pending updates
+        '''
+        self.timer_registered = False
+        if _watcher is not self:
+            return None # Watching stopped or restarted since the timer was registered
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        if depsgraph.scene.name_full != self.scene_name:
+            return None # Another scene is being edited
+        try:
+            self.update(depsgraph)
+        except OSError as e:
+            # Files may be locked or removed while they are written, the next update writes them again
+            self.converter.export_ctx.log(f"Failed to update '{self.filepath}': {e}", 'ERROR')
+        finally:
+            self.clear_updates()
+        return None
+
+def is_instanced(export_ctx, b_object, particles):
+    '''
+    Check if an object is exported through a shapegroup
+    '''
+    return (b_object.is_instancer
+            or b_object.name in particles
+            or (b_object.parent is not None and b_object.parent.is_instancer)
+            or b_object.name_full in export_ctx.shared_meshes)
+
+def object_fingerprint(b_object):
+    '''
+    Identify what is exported for an object, apart from its materials and
+    the data of lights and cameras, which are flagged as updated by Blender.
+    Returns None for objects that are converted to meshes when exported,
+    which are always exported again.
+    '''
+    if b_object.type in {'LIGHT', 'CAMERA'}:
+        return (matrix_fingerprint(b_object.matrix_world), b_object.hide_render)
+    if b_object.type != 'MESH':
+        return None
+    return (mesh_fingerprint(b_object.data),
+            matrix_fingerprint(b_object.matrix_world),
+            tuple(slot.material.name_full if slot.material else None for slot in b_object.material_slots),
+            b_object.hide_render)
+
+# The scene being watched, if any
+_watcher = None
+
+def depsgraph_updated(scene, depsgraph=None):
+    if _watcher is None or depsgraph is None:
+        return
+    _watcher.add_updates(depsgraph)
+    if _watcher.has_updates() and not _watcher.timer_registered:
+        _watcher.timer_registered = True
+        bpy.app.timers.register(_watcher.flush_callback, first_interval=IncrementalExporter.delay)
+
+def start_watching(depsgraph, filepath, split_files, settings):
+    '''
+    Export the scene, then keep the export in sync with the changes made to it
+    '''
+    global _watcher
+    stop_watching()
+    watcher = IncrementalExporter(filepath, split_files, settings)
+    watcher.export_all(depsgraph)
+    _watcher = watcher
+    bpy.app.handlers.depsgraph_update_post.append(depsgraph_updated)
+
+def stop_watching():
+    global _watcher
+    if depsgraph_updated in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(depsgraph_updated)
+    if _watcher is not None and bpy.app.timers.is_registered(_watcher.flush_callback):
+        bpy.app.timers.unregister(_watcher.flush_callback)
+    _watcher = None
+
+def watched_filepath():
+    '''
+    Return the path of the watched export, None if no scene is watched
+    '''
+    return _watcher.filepath if _watcher is not None else None
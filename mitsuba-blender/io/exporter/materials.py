@@ -11,7 +11,7 @@ def export_texture_node(export_ctx, tex_node):
         'type':'bitmap'
     }
     #get the relative path to the copied texture from the full path to the original texture
-    params['filename'] = export_ctx.export_texture(tex_node.image)
+    params.update(export_ctx.image_params(tex_node.image))
     #TODO: texture transform (mapping node)
     if tex_node.image.colorspace_settings.name in ['Non-Color', 'Raw', 'Linear']:
         #non color data, tell mitsuba not to apply gamma conversion to it
@@ -386,13 +386,13 @@ def export_material(export_ctx, material):
 
     mat_id = "mat-%s" % material.name
 
-    mat_params = b_material_to_dict(export_ctx, material)
-
     #TODO: hide emitters
-    if export_ctx.data_get(mat_id) is not None:
+    if export_ctx.data_get(mat_id) is not None or export_ctx.exported_mats.has_mat(mat_id):
         #material was already exported
         return
 
+    mat_params = b_material_to_dict(export_ctx, material)
+
     if isinstance(mat_params, list): # Add/mix shader
         mats = {}
         for mat in mat_params:
@@ -463,9 +463,9 @@ def convert_world(export_ctx, world, ignore_background):
                 if color_node.type == 'TEX_ENVIRONMENT':
                     params.update({
                         'type': 'envmap',
-                        'filename': export_ctx.export_texture(color_node.image),
                         'scale': strength
                     })
+                    params.update(export_ctx.image_params(color_node.image))
                     coordinate_mat = Matrix(((0,0,1,0),(1,0,0,0),(0,1,0,0),(0,0,0,1)))
                     to_world = Matrix()#4x4 Identity
                     if color_node.inputs["Vector"].is_linked:
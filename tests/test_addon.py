@@ -15,3 +15,172 @@ def test_prespective_sensor():
 
     bl_camera, world_matrix = sensors.mi_perspective_to_bl_camera(mi_context, mi_sensor_props)
     assert bl_camera.type == 'PERSP'
+
+def test_split_mesh():
+    import importlib
+    geometry = importlib.import_module("mitsuba-blender.io.exporter.geometry")
+    export_context = importlib.import_module("mitsuba-blender.io.exporter.export_context")
+    export_ctx = export_context.ExportContext()
+
+    # Two quads sharing an edge, with one material each
+    b_mesh = bpy.data.meshes.new("split_mesh")
+    b_mesh.from_pydata([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (2, 0, 0), (2, 1, 0)], [], [(0, 1, 2, 3), (1, 4, 5, 2)])
+    b_mesh.polygons[1].material_index = 1
+    b_mesh.uv_layers.new(name="UVMap")
+    parts = geometry.split_mesh(export_ctx, b_mesh, None, [0, 1])
+    assert sorted(parts) == [0, 1]
+    for part in parts.values():
+        assert part['faces'].shape == (2, 3)
+        assert len(part['positions']) == 4
+        assert part['faces'].min() == 0 and part['faces'].max() == 3
+    # Only exported slots are split
+    assert sorted(geometry.split_mesh(export_ctx, b_mesh, None, [1])) == [1]
+    bpy.data.meshes.remove(b_mesh)
+
+def test_export_tasks():
+    import importlib
+    from concurrent.futures import ThreadPoolExecutor
+    import mitsuba as mi
+    export_context = importlib.import_module("mitsuba-blender.io.exporter.export_context")
+    export_ctx = export_context.ExportContext()
+    results = []
+
+    def task(index):
+        if index == 3:
+            raise ValueError(index)
+        results.append(index)
+
+    # Without a thread pool, tasks run right away
+    export_ctx.run_task(task, 0)
+    assert results == [0]
+
+    export_ctx.thread_env = mi.ThreadEnvironment()
+    with ThreadPoolExecutor(4) as executor:
+        export_ctx.executor = executor
+        for index in range(1, 8):
+            export_ctx.run_task(task, index)
+        try:
+            export_ctx.wait_tasks()
+            assert False, "The error of the failed task is raised"
+        except ValueError as e:
+            assert e.args == (3,)
+    assert sorted(results) == [0, 1, 2, 4, 5, 6, 7]
+    assert export_ctx.pending_tasks == []
+
+    # Once max_pending_tasks are in flight, the oldest one is waited for
+    export_ctx.max_pending_tasks = 2
+    with ThreadPoolExecutor(4) as executor:
+        export_ctx.executor = executor
+        for index in range(8, 16):
+            export_ctx.run_task(task, index)
+            assert len(export_ctx.pending_tasks) <= 2
+        export_ctx.wait_tasks()
+    assert sorted(results) == [0, 1, 2, 4, 5, 6, 7, *range(8, 16)]
+
+def test_find_shared_meshes():
+    import importlib
+    geometry = importlib.import_module("mitsuba-blender.io.exporter.geometry")
+    quad = bpy.data.meshes.new("shared_quad")
+    quad.from_pydata([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], [], [(0, 1, 2, 3)])
+    triangle = bpy.data.meshes.new("shared_triangle")
+    triangle.from_pydata([(0, 0, 0), (1, 0, 0), (1, 1, 0)], [], [(0, 1, 2)])
+    objects = [
+        bpy.data.objects.new("shared_a", quad),
+        bpy.data.objects.new("shared_b", quad), # Same datablock
+        bpy.data.objects.new("shared_c", quad.copy()), # Same content
+        bpy.data.objects.new("shared_d", triangle),
+    ]
+    shared_meshes = geometry.find_shared_meshes(objects)
+    assert shared_meshes == {'shared_a': 'shared_a', 'shared_b': 'shared_a', 'shared_c': 'shared_a'}
+    for b_object in objects:
+        b_mesh = b_object.data
+        bpy.data.objects.remove(b_object)
+        if b_mesh.users == 0:
+            bpy.data.meshes.remove(b_mesh)
+
+def test_mesh_cache(tmp_path):
+    import importlib
+    import os
+    geometry = importlib.import_module("mitsuba-blender.io.exporter.geometry")
+    export_context = importlib.import_module("mitsuba-blender.io.exporter.export_context")
+    disk_cache = importlib.import_module("mitsuba-blender.io.exporter.disk_cache")
+    export_ctx = export_context.ExportContext()
+    b_mesh = bpy.data.meshes.new("cached_quad")
+    b_mesh.from_pydata([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], [], [(0, 1, 2, 3)])
+    mesh_data = geometry.read_mesh(export_ctx, b_mesh, None, [0])
+    bpy.data.meshes.remove(b_mesh)
+
+    cache = disk_cache.DiskCache(str(tmp_path / "cache"), 1024**3, '.ply')
+    for export in ("first", "second"):
+        os.makedirs(tmp_path / export)
+        geometry.write_parts(mesh_data, [(0, "quad", str(tmp_path / export / "quad.ply"))], cache)
+    (cached_path, _, _), = cache.entries()
+    # The second export links the file written by the first one
+    assert os.path.samefile(tmp_path / "second" / "quad.ply", cached_path)
+    assert (tmp_path / "first" / "quad.ply").read_bytes() == (tmp_path / "second" / "quad.ply").read_bytes()
+
+def test_incremental_export(tmp_path):
+    import importlib
+    incremental = importlib.import_module("mitsuba-blender.io.exporter.incremental")
+    b_mesh = bpy.data.meshes.new("watched_quad")
+    b_mesh.from_pydata([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], [], [(0, 1, 2, 3)])
+    b_object = bpy.data.objects.new("watched_quad", b_mesh)
+    bpy.context.scene.collection.objects.link(b_object)
+    bpy.context.view_layer.update()
+    world = bpy.context.scene.world
+    b_world = None
+    try:
+        filepath = str(tmp_path / "scene.xml")
+        watcher = incremental.IncrementalExporter(filepath, False, {'axis_mat': Matrix()})
+        watcher.export_all(bpy.context.evaluated_depsgraph_get())
+        entry = watcher.manifest["watched_quad"]
+        assert entry['ids'] == ["mesh-watched_quad"]
+        assert entry['files'] == ["meshes/watched_quad.ply"]
+
+        # Flagged objects that didn't change are not exported again
+        ply_file = tmp_path / "meshes" / "watched_quad.ply"
+        ply_file.unlink()
+        watcher.updated_objects = {"watched_quad"}
+        watcher.update(bpy.context.evaluated_depsgraph_get())
+        assert not ply_file.exists()
+
+        b_object.location = (1, 2, 3)
+        bpy.context.view_layer.update()
+        watcher.update(bpy.context.evaluated_depsgraph_get())
+        assert ply_file.exists()
+        assert watcher.manifest["watched_quad"]['fingerprint'] != entry['fingerprint']
+        assert 'watched_quad.ply' in (tmp_path / "scene.xml").read_text()
+
+        # Pending updates are dropped when watching stops
+        incremental.start_watching(bpy.context.evaluated_depsgraph_get(), filepath, False, {'axis_mat': Matrix()})
+        watcher = incremental._watcher
+        b_object.location = (3, 2, 1)
+        bpy.context.view_layer.update()
+        watcher.updated_objects.add("watched_quad")
+        incremental.depsgraph_updated(bpy.context.scene, bpy.context.evaluated_depsgraph_get())
+        assert bpy.app.timers.is_registered(watcher.flush_callback)
+        incremental.stop_watching()
+        assert not bpy.app.timers.is_registered(watcher.flush_callback)
+        ply_file.unlink()
+        watcher.flush()
+        assert not ply_file.exists()
+
+        # Blender's default background is kept when it isn't ignored
+        b_world = bpy.data.worlds.new("watched_world")
+        b_world.use_nodes = True
+        b_world.node_tree.nodes["Background"].inputs["Color"].default_value = (0.05087608844041824,) * 3 + (1.0,)
+        bpy.context.scene.world = b_world
+        bpy.context.view_layer.update()
+        watcher = incremental.IncrementalExporter(filepath, False, {'axis_mat': Matrix(), 'ignore_background': False})
+        watcher.export_all(bpy.context.evaluated_depsgraph_get())
+        assert "World" in watcher.converter.export_ctx.scene_data
+        watcher.updated_world = True
+        watcher.update(bpy.context.evaluated_depsgraph_get())
+        assert "World" in watcher.converter.export_ctx.scene_data
+    finally:
+        incremental.stop_watching()
+        bpy.context.scene.world = world
+        if b_world is not None:
+            bpy.data.worlds.remove(b_world)
+        bpy.data.objects.remove(b_object)
+        bpy.data.meshes.remove(b_mesh)
@@ -0,0 +1,29 @@
+import importlib
+import os
+import time
+
+def test_disk_cache_lru(tmp_path):
+    disk_cache = importlib.import_module("mitsuba-blender.io.exporter.disk_cache")
+    cache = disk_cache.DiskCache(str(tmp_path), max_size=20, suffix='.bin')
+
+    def write(data):
+        def write_file(filepath):
+            with open(filepath, 'wb') as file:
+                file.write(data)
+        return write_file
+
+    assert cache.get('a') is None
+    cache.put('a', write(b'0' * 8))
+    cache.put('b', write(b'1' * 8))
+    # Mark 'a' as more recently used than 'b'
+    past = time.time() - 10
+    os.utime(cache.path('b'), (past, past))
+    os.utime(cache.path('a'), (past - 10, past - 10))
+    assert cache.get('a') == cache.path('a')
+
+    # The least recently used entry is evicted to fit the new one
+    cache.put('c', write(b'2' * 8))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert sorted(os.listdir(tmp_path)) == ['a.bin', 'c.bin']
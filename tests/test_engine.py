@@ -0,0 +1,252 @@
+import importlib
+
+import pytest
+
+@pytest.mark.parametrize("spp, initial_spp, growth, expected", [
+    (1, 1, 4, [1]),
+    (21, 1, 4, [1, 4, 16]),
+    (64, 1, 4, [1, 4, 16, 43]),
+    (10, 4, 1, [4, 4, 2]),
+    (3, 8, 2, [3]),
+])
+def test_sample_pass_schedule(spp, initial_spp, growth, expected):
+    progressive = importlib.import_module("mitsuba-blender.engine.progressive")
+    passes = progressive.sample_pass_schedule(spp, initial_spp, growth)
+    assert passes == expected
+    assert sum(passes) == spp
+
+def test_film_passes():
+    final = importlib.import_module("mitsuba-blender.engine.final")
+    channel_names = ['R', 'G', 'B', 'A', 'albedo.R', 'albedo.G', 'albedo.B', 'dd.y.T', 'uv.U', 'uv.V']
+    assert final.film_passes(channel_names) == [
+        ['Main', 0, 4, 'RGBA'],
+        ['albedo', 4, 3, 'RGB'],
+        ['dd.y', 7, 1, 'T'],
+        ['uv', 8, 2, 'UV'],
+    ]
+
+def test_phase_timer():
+    stats = importlib.import_module("mitsuba-blender.engine.stats")
+    timer = stats.PhaseTimer()
+    for name in ['Export', 'Render', 'Export']:
+        with timer.phase(name):
+            pass
+    assert list(timer.durations.keys()) == ['Export', 'Render']
+    assert timer.total() == pytest.approx(timer.get('Export') + timer.get('Render'))
+    assert stats.format_duration(3.2) == '3.20s'
+    assert stats.format_duration(62.5) == '1:02.50'
+    assert stats.format_rate(12.3e6, 1.0) == '12.3M/s'
+
+def test_adaptive_sampling():
+    import numpy as np
+    adaptive = importlib.import_module("mitsuba-blender.engine.adaptive")
+
+    # Noise-free batches converge as soon as the error can be estimated
+    sampling = adaptive.AdaptiveSampling(64, 4, noise_threshold=0.01)
+    passes = []
+    for batch_spp in sampling.passes():
+        passes.append(batch_spp)
+        sampling.add(np.ones((2, 2, 3), dtype=np.float32), batch_spp, 1.0)
+    assert passes == [4, 4]
+    assert sampling.error() == 0.0
+
+    # The budget stops rendering before the next batch would exceed it
+    sampling = adaptive.AdaptiveSampling(64, 4, time_budget=3.5)
+    rng = np.random.default_rng(0)
+    for batch_spp in sampling.passes():
+        sampling.add(rng.random((2, 2, 3), dtype=np.float32), batch_spp, 1.0)
+    assert sampling.spp == 12
+    assert sampling.error() > 0.0
+
+    # The sample count is never exceeded
+    sampling = adaptive.AdaptiveSampling(10, 4)
+    passes = []
+    for batch_spp in sampling.passes():
+        passes.append(batch_spp)
+        sampling.add(rng.random((2, 2, 3), dtype=np.float32), batch_spp, 1.0)
+    assert passes == [4, 4, 2]
+
+def test_band_windows():
+    final = importlib.import_module("mitsuba-blender.engine.final")
+    assert final.band_windows(0, 0, 100, 10, 4) == [(0, 0, 100, 4), (0, 4, 100, 4), (0, 8, 100, 2)]
+    # Crop windows, e.g. render borders, are split within their bounds
+    assert final.band_windows(10, 20, 30, 5, 8) == [(10, 20, 30, 5)]
+
+def test_window_time_budget():
+    final = importlib.import_module("mitsuba-blender.engine.final")
+    assert final.window_time_budget(0.0, 5.0, 3) == 0.0
+    # The time left is shared by the windows left, so that bands keep to the budget of the frame
+    assert final.window_time_budget(12.0, 0.0, 4) == 3.0
+    assert final.window_time_budget(12.0, 6.0, 2) == 3.0
+    # Windows still get a positive budget once it is spent
+    assert 0.0 < final.window_time_budget(12.0, 15.0, 2) < 0.01
+
+def test_result_rect():
+    final = importlib.import_module("mitsuba-blender.engine.final")
+    # Without a border, results are placed in the whole frame, from the bottom
+    assert final.result_rect((0, 0, 100, 50), (0, 0, 100, 50)) == (0, 0, 100, 50)
+    assert final.result_rect((0, 0, 100, 50), (0, 10, 100, 20)) == (0, 20, 100, 20)
+    # With a border away from the bottom-left corner, results are relative to the border
+    border = (30, 5, 40, 20) # Rows 25 to 45 from the bottom of a 50 rows frame
+    assert final.result_rect(border, border) == (0, 0, 40, 20)
+    # Bands of the border, from top to bottom
+    bands = final.band_windows(*border, 8)
+    assert [final.result_rect(border, band) for band in bands] == [(0, 12, 40, 8), (0, 4, 40, 8), (0, 0, 40, 4)]
+
+@pytest.mark.parametrize("spp, count, expected", [
+    (16, 4, [4, 4, 4, 4]),
+    (10, 4, [3, 3, 2, 2]),
+    (2, 4, [1, 1]),
+    (7, 1, [7]),
+])
+def test_split_samples(spp, count, expected):
+    worker = importlib.import_module("mitsuba-blender.engine.worker")
+    assert worker.split_samples(spp, count) == expected
+
+def test_kernel_cache_dir(tmp_path):
+    import os
+    worker = importlib.import_module("mitsuba-blender.engine.worker")
+    cache_dir = str(tmp_path / "kernels")
+    try:
+        worker.set_kernel_cache_dir(cache_dir)
+        env = worker.worker_environment()
+        # Dr.Jit's kernel cache is in the home or temporary directory
+        assert env['TMP' if os.name == 'nt' else 'HOME'] == cache_dir
+        assert os.path.isdir(cache_dir)
+    finally:
+        worker.set_kernel_cache_dir(None)
+    # Blender's own process is left untouched
+    assert worker.worker_environment().get('HOME') == os.environ.get('HOME')
+
+def test_render_distributed(tmp_path):
+    import numpy as np
+    worker = importlib.import_module("mitsuba-blender.engine.worker")
+    scene_file = tmp_path / "scene.xml"
+    scene_file.write_text('''<scene version="3.0.0">
+    <integrator type="path"/>
+    <sensor type="perspective">
+        <film type="hdrfilm">
+            <integer name="width" value="8"/>
+            <integer name="height" value="8"/>
+        </film>
+        <sampler type="independent">
+            <integer name="sample_count" value="4"/>
+        </sampler>
+    </sensor>
+    <emitter type="constant"/>
+</scene>''')
+    subsets = worker.split_samples(4, 2)
+    requests = [{
+        'cmd': 'render',
+        'xml': str(scene_file),
+        'variant': 'scalar_rgb',
+        'threads': 1,
+        'spp': subset_spp,
+        'seed_offset': index,
+        'seed_stride': len(subsets),
+    } for index, subset_spp in enumerate(subsets)]
+    updates = []
+    try:
+        completed = worker.render_distributed(worker.get_workers(len(requests)), requests, lambda: False,
+                                              lambda loaded, pixels, spp: updates.append((pixels.copy(), spp)))
+    finally:
+        worker.shutdown_worker()
+    assert completed
+    pixels, spp = updates[-1]
+    assert spp == 4
+    assert pixels.shape[:2] == (8, 8)
+    # A constant environment seen through an empty scene
+    assert np.allclose(pixels[..., :3], 1.0)
+
+    # Cancelled while the workers keep sending films, with one pass per sample
+    requests = [dict(request, spp=256, progressive=(1, 1)) for request in requests]
+    updates = []
+    try:
+        completed = worker.render_distributed(worker.get_workers(len(requests)), requests, lambda: len(updates) >= 2,
+                                              lambda loaded, pixels, spp: updates.append(spp))
+    finally:
+        worker.shutdown_worker()
+    assert not completed
+    assert updates[-1] < 2 * 256
+
+def test_checkpoint(tmp_path):
+    import numpy as np
+    checkpoint = importlib.import_module("mitsuba-blender.engine.checkpoint")
+    filepath = checkpoint.checkpoint_path(str(tmp_path / "checkpoints"), "0123abcd")
+    assert checkpoint.load_checkpoint(filepath) is None
+
+    pixels = np.random.default_rng(0).random((4, 3, 5), dtype=np.float32)
+    channel_names = ['R', 'G', 'B', 'A', 'depth.T']
+    checkpoint.save_checkpoint(filepath, pixels, 64, 7, channel_names)
+    data = checkpoint.load_checkpoint(filepath)
+    assert np.array_equal(data['pixels'], pixels)
+    assert data['spp'] == 64
+    assert data['seed_offset'] == 7
+    assert data['channel_names'] == channel_names
+
+def test_canonical_channel_order():
+    final = importlib.import_module("mitsuba-blender.engine.final")
+    # Channel order of an OpenEXR file
+    channel_names = ['A', 'B', 'G', 'R', 'albedo.B', 'albedo.G', 'albedo.R', 'depth.T']
+    order = final.canonical_channel_order(channel_names)
+    assert [channel_names[index] for index in order] == ['R', 'G', 'B', 'A', 'albedo.R', 'albedo.G', 'albedo.B', 'depth.T']
+
+def test_exr_writer(tmp_path):
+    import numpy as np
+    import mitsuba as mi
+    output = importlib.import_module("mitsuba-blender.engine.output")
+    pixels = np.random.default_rng(0).random((4, 3, 5), dtype=np.float32)
+    channel_names = ['R', 'G', 'B', 'A', 'depth.T']
+    writer = output.ExrWriter()
+    for half_float in (False, True):
+        bitmap = mi.Bitmap(pixels, mi.Bitmap.PixelFormat.MultiChannel, channel_names)
+        writer.submit(mi.ThreadEnvironment(), bitmap, str(tmp_path / f"{half_float}.exr"), half_float)
+    writer.flush()
+    assert writer.pop_errors() == []
+
+    full = mi.Bitmap(str(tmp_path / "False.exr"))
+    half = mi.Bitmap(str(tmp_path / "True.exr"))
+    assert full.component_format() == mi.Struct.Type.Float32
+    assert half.component_format() == mi.Struct.Type.Float16
+    assert sorted(field.name for field in half.struct_()) == sorted(channel_names)
+    assert np.allclose(np.array(half, dtype=np.float32), np.array(full, dtype=np.float32), atol=1e-3)
+
+def test_direct_output_path(tmp_path):
+    import bpy
+    output = importlib.import_module("mitsuba-blender.engine.output")
+    b_scene = bpy.context.scene
+    render = b_scene.render
+    filepath, file_format = render.filepath, render.image_settings.file_format
+    try:
+        render.filepath = str(tmp_path / "frame_")
+        render.image_settings.file_format = 'OPEN_EXR'
+        blender_path = render.frame_path(frame=b_scene.frame_current)
+        path = output.direct_output_path(b_scene)
+        # Blender's own EXR output must not be overwritten
+        assert path != blender_path
+        assert path.endswith('.exr')
+        assert output.direct_output_path(b_scene, (0, 8, 16, 8)) not in {path, blender_path}
+    finally:
+        render.filepath, render.image_settings.file_format = filepath, file_format
+
+def test_render_depsgraph():
+    import bpy
+    import numpy as np
+    import mitsuba as mi
+    api = importlib.import_module("mitsuba-blender.engine.api")
+    b_scene = bpy.context.scene
+    render = b_scene.render
+    # The scene is shared with the other tests
+    saved = (b_scene.mitsuba.variant, render.resolution_x, render.resolution_y, render.resolution_percentage)
+    try:
+        b_scene.mitsuba.variant = mi.variant()
+        render.resolution_x = 16
+        render.resolution_y = 8
+        render.resolution_percentage = 100
+        passes = api.render_depsgraph(bpy.context.evaluated_depsgraph_get(), spp=2, aovs=['dd.y:depth'])
+        assert set(passes) == {'Main', 'dd.y'}
+        assert passes['Main'].dtype == np.float32
+        assert passes['Main'].shape == (8, 16, 4)
+        assert passes['dd.y'].shape == (8, 16, 1)
+    finally:
+        b_scene.mitsuba.variant, render.resolution_x, render.resolution_y, render.resolution_percentage = saved